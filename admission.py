@@ -0,0 +1,90 @@
+import math
+import time
+import asyncio
+
+
+class Overloaded(Exception):
+    """服务已满载：调用方应返回 429，并在 Retry-After 秒后重试"""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    /chat 的准入控制 (背压)：
+    - 最多 max_concurrent 个请求同时跑引擎，多出来的排队
+    - 排队的超过 max_queue 个，新请求直接拒绝 (快速失败，不让请求堆积拖垮整个服务)
+    - 排队超过 queue_timeout 秒还没轮到，也拒绝
+    全部在事件循环里完成，不占线程；/health 这类接口不经过它，满载时照样秒回
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = None  # 第一次用的时候再建，保证绑定的是 uvicorn 的事件循环
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._service_total = 0.0
+        self._service_count = 0
+
+    def retry_after(self) -> int:
+        """按平均处理时长估算多久之后能排上 (至少 1 秒)"""
+        avg_service = self._service_total / self._service_count if self._service_count else 1.0
+        backlog = self.waiting + 1
+        return max(1, math.ceil(avg_service * backlog / self.max_concurrent))
+
+    async def acquire(self) -> float:
+        """拿到一个执行名额，返回拿到名额的时间点 (release 时要传回来)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        # 正在跑的 + 排队的 已经占满 "并发数 + 队列长度"，新请求直接拒绝
+        if self.in_flight + self.waiting >= self.max_concurrent + self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.retry_after(), "queue full")
+
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.rejected += 1
+            raise Overloaded(self.retry_after(), "queue timeout")
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - start
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self.admitted += 1
+        self.in_flight += 1
+        return time.perf_counter()
+
+    def release(self, admitted_at: float):
+        self.in_flight -= 1
+        self._service_total += time.perf_counter() - admitted_at
+        self._service_count += 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_length": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self._wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self._wait_max * 1000, 1),
+            "avg_service_ms": round(self._service_total / self._service_count * 1000, 1) if self._service_count else 0.0
+        }
@@ -1,21 +1,37 @@
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+import json
 import uvicorn
 import config
 import traceback
 import shutil # 👈 用来保存文件
 import os     # 用来创建文件夹
-from pdf_loader import load_pdf_to_chroma
+from ingest_jobs import IngestJobQueue
+from admission import AdmissionController, Overloaded
+from metrics import process_memory, timed_stage, EngineCollector, IN_FLIGHT
+from chat_batch import run_batch
 
 # 1. 引入你的核心引擎
 # 这就是"模块化"的好处，我们不需要重写 RAG 逻辑，直接 import 进来！
 from securag_engine import SecuRAG
+import registry
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 关停：PII 审计队列里还没做完的先做完、写进日志，再停掉后台线程
+    if bot.pii_auditor is not None:
+        bot.pii_auditor.close()
 
 # 2. 初始化 API APP
 app = FastAPI(
     title="SecuRAG Core API",
     description="基于本地大模型(Ollama)与RAG技术的安全防御API",
-    version="1.0"
+    version="1.0",
+    lifespan=lifespan
 )
 
 # 3. 启动引擎 (全局单例模式)
@@ -23,6 +39,42 @@ app = FastAPI(
 # ... (之前的代码) ...
 print("🚀 正在启动 API 服务器...")
 bot = SecuRAG()
+# 后台入库队列 (上次没跑完的任务会自动恢复；serve.py 拉起的新 worker 只接手挂掉的 worker 的任务)
+ingest_queue = IngestJobQueue(bot, resume=config.INGEST_RESUME_ON_START, resume_owner=config.INGEST_RESUME_OWNER)
+# 聊天接口的准入控制：满载时直接回 429，别让请求越堆越多
+admission = AdmissionController(
+    max_concurrent=config.CHAT_MAX_CONCURRENT,
+    max_queue=config.CHAT_MAX_QUEUE,
+    queue_timeout=config.CHAT_QUEUE_TIMEOUT
+)
+
+# Prometheus：缓存 / 请求合并 / 准入 / 连接复用这些已有的统计，抓取 /metrics 时现读
+REGISTRY.register(EngineCollector(bot, admission))
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    占着准入名额的流式响应：名额在响应发完 (或客户端断开、发送出错) 时释放。
+    不能放在 body 生成器的 finally 里 —— 客户端在 body 开始迭代之前就断开的话，
+    生成器根本没启动，finally 不会执行，名额就永远漏掉了
+    """
+
+    def __init__(self, content, admitted_at: float, **kwargs):
+        super().__init__(content, **kwargs)
+        self.admitted_at = admitted_at
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(self.admitted_at)
+
+def overloaded_response(e: Overloaded) -> JSONResponse:
+    print(f"🚦 [API] 服务满载，拒绝请求 ({e.reason})，建议 {e.retry_after}s 后重试")
+    return JSONResponse(
+        status_code=429,
+        content={"status": "overloaded", "msg": "服务繁忙，请稍后重试", "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
 # --- 🔥 新增：心跳检测接口 (Heartbeat) ---
 # 前端只用 ping 这个接口，不用传任何数据，响应快
@@ -30,6 +82,35 @@ bot = SecuRAG()
 async def health_check():
     return {"status": "ok", "service": "SecuRAG-API"}
 
+# --- 运行统计：给调参用 (例如本地路由的升级率) ---
+@app.get("/stats")
+async def stats():
+    return {
+        "router": bot.router.stats(),
+        "firewall_cache": bot.verdict_cache.stats(),
+        "screening": bot.guard.matcher.stats(),
+        "semantic_cache": bot.semantic_cache.stats() if bot.semantic_cache is not None else None,
+        "sessions": bot.sessions.stats(),
+        "pii_audit": bot.pii_auditor.stats() if bot.pii_auditor is not None else None,
+        "retrieval": {
+            "latency": bot.retrieval_latency.stats(),
+            "vector_batching": bot.vector_batcher.stats(),
+            "lexical_index": bot.lexical_index.stats() if bot.lexical_index is not None else None
+        },
+        "admission": admission.stats(),
+        "llm_transport": bot.transport.stats(),
+        "singleflight": bot.singleflight.stats(),
+        "worker": {"pid": os.getpid(), "memory": process_memory()},
+        "startup_seconds": registry.startup_report(),
+        "ingest_jobs": ingest_queue.stats()
+    }
+
+# --- Prometheus 指标：各阶段耗时直方图、路线计数、缓存命中、token 用量、在途请求 ---
+# 多 worker (serve.py) 时每个 worker 各报各的，抓到的是当前这个 worker 的数据
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
 # ... (之后的 chat 接口保持不变) ...
 
 print("✅ 引擎加载完毕，等待请求...")
@@ -49,9 +130,14 @@ async def chat(request: ChatRequest):
     输出: {"answer": "AMOGEL是..."}
     """
     try:
-        # 调用核心引擎的 chat 方法
+        admitted_at = await admission.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+    try:
+        # 调用核心引擎的异步 chat 方法 (前置阶段并发执行，不再占着 worker 干等)
         user_query = request.query
-        response = bot.chat(user_query, request.session_id, request.temperature)
+        with IN_FLIGHT.labels("/chat").track_inprogress(), timed_stage("request_chat"):
+            response = await bot.achat(user_query, request.session_id, request.temperature)
         
         # 返回标准的 JSON
         return {
@@ -68,13 +154,69 @@ async def chat(request: ChatRequest):
         # 返回 500 给前端
         raise HTTPException(status_code=500, detail=str(e))
 
+    finally:
+        admission.release(admitted_at)
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    流式聊天接口 (Server-Sent Events)
+    每段 token 一个 `event: token`，出错时 `event: error`，
+    最后固定一个 `event: done`，带上走了哪条路 (blocked / chat / rag) 和检索到的片段数
+    """
+    # 名额在返回响应之前就拿好，满载时才能回 429；整个流结束 (或客户端断开) 才释放
+    try:
+        admitted_at = await admission.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    async def event_source():
+        with IN_FLIGHT.labels("/chat/stream").track_inprogress(), timed_stage("request_chat_stream"):
+            async for event in bot.achat_stream(request.query, request.session_id, request.temperature):
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    # 客户端断开时 Starlette 会取消这个生成器，引擎那边的 finally 负责把已生成的部分记进历史
+    return AdmittedStreamingResponse(
+        event_source(),
+        admitted_at,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class BatchItem(BaseModel):
+    query: str
+    session_id: str = None  # 不填就用一个独立的新会话
+    id: str = None  # 调用方自己的编号，原样带回
+
+class ChatBatchRequest(BaseModel):
+    items: list[BatchItem] = Field(..., min_length=1, max_length=config.CHAT_BATCH_MAX_ITEMS)
+    temperature: float = 0.1
+    concurrency: int = None  # 批内并发数，不填用 config.CHAT_BATCH_CONCURRENCY
+
+@app.post("/chat/batch")
+async def chat_batch(request: ChatBatchRequest):
+    """
+    批量问答接口 (回归测试 / 批量报告)：
+    输入: {"items": [{"query": "...", "session_id": "可选", "id": "可选"}, ...]}
+    输出: NDJSON，每跑完一条吐一行 (完成顺序，用 index 对回原来的位置)，带各阶段耗时
+    每条单独占一个准入名额 (和 /chat 共用同一个并发上限)，批内并发由 concurrency 控制
+    """
+    items = [item.model_dump() for item in request.items]
+
+    async def lines():
+        with IN_FLIGHT.labels("/chat/batch").track_inprogress(), timed_stage("request_chat_batch"):
+            async for result in run_batch(bot, items, request.temperature, request.concurrency, admission=admission):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     """
     文件上传接口：
     1. 接收前端传来的 PDF
     2. 保存到本地
-    3. 调用 RAG 引擎进行切片入库
+    3. 登记一个后台入库任务，立刻返回 job_id (进度去 /jobs/{job_id} 查)
     """
     try:
         # 1. 确保有个放文件的地方
@@ -87,15 +229,23 @@ async def upload_file(file: UploadFile = File(...)):
             
         print(f"📂 [API] 接收到文件: {file.filename}")
         
-        # 3. 呼叫 PDF 加载器 (Day 19 的代码)
-        # 这一步会把 PDF 变成向量存进 ChromaDB
-        load_pdf_to_chroma(file_path)
+        # 3. 交给后台队列：解析 / 切片 / 向量化不再占着这个请求
+        job_id = ingest_queue.submit(file_path, file.filename)
         
-        return {"status": "success", "filename": file.filename, "msg": "知识库入库成功！"}
+        return {"status": "queued", "job_id": job_id, "filename": file.filename, "msg": "已加入入库队列"}
 
     except Exception as e:
         print(f"❌ 上传失败: {e}")
         return {"status": "error", "msg": str(e)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """入库任务进度：state / chunks_done / chunks_total / chunks_per_sec / error"""
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
 # 6. 启动入口
 if __name__ == "__main__":
     # host="0.0.0.0" 代表允许局域网访问
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+# 对比两套 Presidio 安检配置 (full / light) 的 延迟、常驻内存、召回率
+# 用法: python benchmark_guard.py              -> 两套配置各起一个子进程跑，输出对比表
+#       python benchmark_guard.py light        -> 只跑一套，输出 JSON (给父进程读)
+CORPUS_PATH = "guard_benchmark_corpus.json"
+PROFILES = ["full", "light"]
+ROUNDS = 5  # 整个语料重复跑几轮，延迟取分位数
+
+
+def rss_mb() -> float:
+    """当前进程的常驻内存 (MB)"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_profile(profile: str) -> dict:
+    """在当前进程里加载一套配置并测量 (每套配置单独一个进程，内存互不干扰)"""
+    os.environ["GUARD_PROFILE"] = profile
+    with open(CORPUS_PATH, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    from security_guard import SecurityGuard
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    guard = SecurityGuard(profile=profile)
+    load_seconds = time.perf_counter() - start
+    guard.find_pii("Warm up")  # 第一次调用有懒初始化，不算进延迟
+    guard.prefilter_skips = 0
+
+    latencies = []
+    for _ in range(ROUNDS):
+        for case in corpus:
+            t0 = time.perf_counter()
+            guard.find_pii(case["text"])
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    # 召回率：标注的实体类型里，有多少被找到了 (只看置信度 > 0.6 的结果，和 _check_safety 一致)
+    expected = found = 0
+    for case in corpus:
+        detected = {res.entity_type for res in guard.find_pii(case["text"]) if res.score > 0.6}
+        expected += len(case["entities"])
+        found += len(set(case["entities"]) & detected)
+
+    return {
+        "profile": profile,
+        "load_seconds": round(load_seconds, 2),
+        "rss_mb": round(rss_mb() - base_rss, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "avg_ms": round(sum(latencies) / len(latencies), 3),
+        "recall": round(found / expected, 3) if expected else None,
+        "prefilter_skip_rate": round(guard.prefilter_skips / ((ROUNDS + 1) * len(corpus)), 3)
+    }
+
+
+def compare():
+    print(f"🏁 Presidio 安检配置对比 (语料: {CORPUS_PATH}，每套 {ROUNDS} 轮)")
+    print("=" * 60)
+    rows = []
+    for profile in PROFILES:
+        proc = subprocess.run([sys.executable, __file__, profile], capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"❌ {profile} 跑失败了 (模型装了吗?):\n{proc.stderr.strip()[-500:]}")
+            continue
+        rows.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    columns = ["profile", "load_seconds", "rss_mb", "p50_ms", "p95_ms", "avg_ms", "recall", "prefilter_skip_rate"]
+    print(" | ".join(f"{column:>19}" for column in columns))
+    for row in rows:
+        print(" | ".join(f"{str(row[column]):>19}" for column in columns))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # 子进程模式：只输出最后一行 JSON
+        print(json.dumps(run_profile(sys.argv[1])))
+    else:
+        compare()
@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from benchmark_guard import percentile
+
+# SecuRAG 流水线分阶段基准测试 (全部在进程内跑，不连真的大模型、不碰正式知识库)
+# - 大模型换成确定性的替身 (固定回答，可选模拟延迟)，测出来的是我们自己代码的开销
+# - 知识库是临时目录里的 Chroma 集合，灌合成文档 (向量随机生成，不跑 embedding，百万级也灌得动)
+# - 每个语料规模单独一个子进程，峰值内存互不干扰
+# 用法: python benchmark_pipeline.py                               -> 默认 1k / 10k / 100k 三档
+#       python benchmark_pipeline.py --sizes 1000,1000000           -> 自定义规模 (最大到 1M)
+#       python benchmark_pipeline.py --save-baseline baseline.json  -> 存基线
+#       python benchmark_pipeline.py --compare baseline.json        -> 和基线对比，p95 变慢超过阈值就以 1 退出
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+STAGES = ["screen", "sanitize", "pii", "firewall", "intent", "rewrite", "vector_query", "retrieve", "generate", "end_to_end"]
+INSERT_BATCH = 5000
+
+_WORDS = ("model accuracy dataset training graph neural network security policy audit encryption "
+          "latency throughput retrieval vector index query document privacy firewall token cache "
+          "session benchmark pipeline gradient layer attention embedding storage backup access").split()
+_CJK_WORDS = ["模型", "准确率", "数据集", "安全", "隐私", "检索", "向量", "索引", "加密", "审计"]
+
+
+# ==========================================
+# 确定性的大模型替身 (同步 / 异步两套，接口和 openai 客户端一样)
+# ==========================================
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content: str):
+        self.message = _Message(content)
+        self.delta = _Message(content)
+
+
+class _Response:
+    def __init__(self, content: str):
+        self.choices = [_Choice(content)]
+        self.usage = None
+
+
+class _FakeStream:
+    """流式响应替身：和 openai 的 Stream 一样能迭代、能 close()"""
+
+    def __init__(self, chunks: list):
+        self._chunks = iter(chunks)
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        self._chunks = iter(())
+
+
+class _AsyncFakeStream(_FakeStream):
+    """异步流式响应替身：async for 迭代，await close()"""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        self._chunks = iter(())
+
+
+def fake_reply(messages: list) -> str:
+    """按 Prompt 类型给固定回答：防火墙 SAFE、意图 SEARCH、重写原样返回、生成给一段固定文本"""
+    prompt = messages[0]["content"]
+    if "AI 安全审计" in prompt:
+        return "SAFE"
+    if "意图分类器" in prompt:
+        return "SEARCH"
+    if "查询重写" in prompt:
+        return prompt.split("用户最新问题:")[-1].split("\n")[0].strip()
+    return f"Benchmark answer for: {messages[-1]['content'][:40]}"
+
+
+class _FakeCompletions:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        response = _Response(fake_reply(messages))
+        return _FakeStream([response]) if stream else response
+
+
+class _AsyncFakeCompletions(_FakeCompletions):
+    async def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        import asyncio
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = _Response(fake_reply(messages))
+        return _AsyncFakeStream([response]) if stream else response
+
+
+class _FakeChat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class FakeLLMClient:
+    def __init__(self, latency: float = 0.0, asynchronous: bool = False):
+        completions = _AsyncFakeCompletions(latency) if asynchronous else _FakeCompletions(latency)
+        self.chat = _FakeChat(completions)
+
+
+# ==========================================
+# 合成语料
+# ==========================================
+def synthetic_document(rng: random.Random, index: int) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(30, 80))]
+    words.insert(rng.randrange(len(words)), f"X-{index % 9973}")
+    words.insert(rng.randrange(len(words)), rng.choice(_CJK_WORDS))
+    return " ".join(words) + "."
+
+
+def synthetic_queries(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return [f"What is the {rng.choice(_WORDS)} {rng.choice(_WORDS)} of X-{rng.randrange(9973)}?" for _ in range(count)]
+
+
+def fill_collection(bot, size: int, seed: int = 42):
+    """灌 size 条合成片段：正文 + 随机单位向量 (维度和集合的 embedding 函数一致)，BM25 索引同步更新"""
+    import numpy as np
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    dim = len(bot.collection._embedding_function(["dimension probe"])[0])
+    for start in range(0, size, INSERT_BATCH):
+        count = min(INSERT_BATCH, size - start)
+        ids = [f"bench-{start + i}" for i in range(count)]
+        documents = [synthetic_document(rng, start + i) for i in range(count)]
+        vectors = np_rng.standard_normal((count, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        bot.collection.add(ids=ids, documents=documents, embeddings=vectors)
+        if bot.lexical_index is not None:
+            bot.lexical_index.add(ids, documents)
+
+
+# ==========================================
+# 测量
+# ==========================================
+def peak_rss_mb() -> float:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 下单位是 KB
+
+
+def measure(fn, inputs: list, before=None) -> dict:
+    """每个输入调用一次 fn，before (比如清缓存) 不计时"""
+    latencies = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        fn(inputs[0])  # 预热 (懒加载、第一次编译正则等)
+        for item in inputs:
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    return {
+        "n": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "ops_per_sec": round(len(latencies) / total, 1) if total else None
+    }
+
+
+def run_size(size: int, iterations: int, llm_latency: float) -> dict:
+    """[子进程] 建临时知识库、灌语料，逐阶段测一遍"""
+    workdir = tempfile.mkdtemp(prefix="securag-bench-")
+    try:
+        import config
+        # 会话、入库清单、审计日志全部落在临时目录里，不碰正式数据
+        config.SESSION_BACKEND = "memory"
+        config.INGEST_MANIFEST_DB = os.path.join(workdir, "ingest_manifest.db")
+        config.PII_AUDIT_LOG = os.path.join(workdir, "pii_audit.jsonl")
+        config.ROUTER_CENTROIDS_PATH = os.path.join(workdir, "intent_centroids.json")
+        from securag_engine import SecuRAG
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            bot = SecuRAG(db_path=os.path.join(workdir, "db"), collection_name="benchmark")
+        bot.client = FakeLLMClient(llm_latency)
+        bot.async_client = FakeLLMClient(llm_latency, asynchronous=True)
+        # 单线程逐个查询时微批窗口只会白等，关掉 (测的是检索本身的开销)
+        bot.vector_batcher.window = 0
+
+        start = time.perf_counter()
+        fill_collection(bot, size)
+        fill_seconds = time.perf_counter() - start
+
+        queries = synthetic_queries(iterations)
+        history = [{"role": "user", "content": "What is X-42?"}, {"role": "assistant", "content": "X-42 is a model."}]
+        embeddings = bot.collection._embedding_function(queries)
+        n_results = bot._candidate_count()
+        sessions = iter(range(10 ** 9))
+
+        stages = {
+            "screen": (lambda q: bot.guard.check_injection(q), None),
+            "sanitize": (lambda q: bot.guard._sanitize_input(q), None),
+            "pii": (lambda q: bot.guard._check_safety(q), None),
+            "firewall": (lambda q: bot.analyze_risk(q), bot.verdict_cache.clear),
+            "intent": (lambda q: bot._decide_intent(q), None),
+            "rewrite": (lambda q: bot._rewrite_query(q, history), None),
+            "vector_query": (lambda i: bot.collection.query(query_embeddings=[embeddings[i]], n_results=n_results), None),
+            "retrieve": (lambda q: bot._retrieve_context(q, q), None),
+            "generate": (lambda q: bot._complete([{"role": "system", "content": "bench"}, {"role": "user", "content": q}]), None),
+            # 每次一个新会话 (不走历史)；判决缓存清掉，防火墙每次都真跑
+            "end_to_end": (lambda q: bot.chat(q, f"bench-{next(sessions)}"), bot.verdict_cache.clear),
+        }
+        results = {}
+        for stage in STAGES:
+            fn, before = stages[stage]
+            inputs = list(range(len(queries))) if stage == "vector_query" else queries
+            # screen 的结果有缓存，换成每次都不一样的输入才测得到真实扫描开销
+            if stage == "screen":
+                inputs = [f"{q} #{i}" for i, q in enumerate(queries)]
+            results[stage] = measure(fn, inputs, before)
+
+        return {
+            "size": size,
+            "fill_seconds": round(fill_seconds, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": results
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ==========================================
+# 汇总 / 基线对比
+# ==========================================
+def print_report(report: dict):
+    for size, result in report["sizes"].items():
+        print(f"\n📚 语料 {int(size):,} 条 | 灌库 {result['fill_seconds']}s | 峰值内存 {result['peak_rss_mb']} MB")
+        columns = ["p50_ms", "p95_ms", "p99_ms", "ops_per_sec"]
+        print(f"{'stage':>14} | " + " | ".join(f"{column:>11}" for column in columns))
+        for stage, row in result["stages"].items():
+            print(f"{stage:>14} | " + " | ".join(f"{str(row[column]):>11}" for column in columns))
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """p95 比基线慢超过 threshold (比例) 的阶段算回归"""
+    regressions = []
+    print(f"\n🔍 与基线对比 (p95 变慢超过 {threshold:.0%} 算回归)")
+    for size, result in report["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if base is None:
+            print(f"   语料 {size}: 基线里没有这一档，跳过")
+            continue
+        for stage, row in result["stages"].items():
+            old = base["stages"].get(stage)
+            if not old or not old["p95_ms"]:
+                continue
+            change = row["p95_ms"] / old["p95_ms"] - 1
+            flag = "❌" if change > threshold else "✅"
+            print(f"   {flag} {size:>8} {stage:>14}: p95 {old['p95_ms']} -> {row['p95_ms']} ms ({change:+.1%})")
+            if change > threshold:
+                regressions.append((size, stage, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SecuRAG 流水线分阶段基准测试")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="语料规模，逗号分隔")
+    parser.add_argument("--iterations", type=int, default=200, help="每个阶段跑多少个查询")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="大模型替身的模拟延迟 (默认 0，只测我们自己的开销)")
+    parser.add_argument("--save-baseline", help="把结果存成基线 JSON")
+    parser.add_argument("--compare", help="和这个基线 JSON 对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 变慢多少算回归 (默认 0.2 = 20%%)")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        # 子进程模式：只输出最后一行 JSON
+        print(json.dumps(run_size(args.child, args.iterations, args.llm_latency_ms / 1000)))
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"🏁 SecuRAG 流水线基准测试: 语料 {sizes}，每阶段 {args.iterations} 次，LLM 替身延迟 {args.llm_latency_ms}ms")
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "iterations": args.iterations,
+        "llm_latency_ms": args.llm_latency_ms,
+        "sizes": {}
+    }
+    for size in sizes:
+        print(f"⏳ 正在测 {size:,} 条语料...")
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", str(size), "--iterations", str(args.iterations),
+             "--llm-latency-ms", str(args.llm_latency_ms)],
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            print(f"❌ {size} 条跑失败了:\n{proc.stderr.strip()[-800:]}")
+            continue
+        report["sizes"][str(size)] = json.loads(proc.stdout.strip().splitlines()[-1])
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 基线已保存: {args.save_baseline}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import re
+import time
+import asyncio
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """
+    缓存键归一化：NFKC (全角 -> 半角) + 大小写折叠 + 空白压缩
+    "  Ignore  ALL  " 和 "ignore all" 会落到同一个键上
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE.sub(" ", text.casefold()).strip()
+
+
+class LRUTTLCache:
+    """
+    有界的 LRU + TTL 缓存 (线程安全)
+    - 满了淘汰最久没用的条目
+    - 每个条目可以有自己的过期时间 (默认用 ttl)
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间戳, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存：问法不同但意思相同的问题直接复用上次的回答。
+    命中条件 (缺一不可)：
+    1. 问题向量的余弦距离 <= max_distance
+    2. 检索出来的 chunk id 集合完全一样 (保证答案基于同一批背景知识)
+    3. 命名空间一致 (知识库版本号 + 模型名)，入库后自动全部作废
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 3600.0, max_distance: float = 0.08):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # entry_id -> (过期时间戳, 向量, chunk_ids, answer)
+        self._namespace = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_namespace(self, namespace):
+        # 调用方需持有锁
+        if namespace != self._namespace:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._namespace = namespace
+
+    def lookup(self, embedding, chunk_ids, namespace):
+        vector = self._normalize(embedding)
+        chunk_ids = frozenset(chunk_ids)
+        now = time.monotonic()
+        with self._lock:
+            self._check_namespace(namespace)
+            best_id, best_distance = None, None
+            for entry_id, (expires_at, cached_vector, cached_ids, _) in list(self._entries.items()):
+                if expires_at <= now:
+                    del self._entries[entry_id]
+                    continue
+                if cached_ids != chunk_ids:
+                    continue
+                distance = 1.0 - float(vector @ cached_vector)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_id, best_distance = entry_id, distance
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][3]
+
+    def store(self, embedding, chunk_ids, answer: str, namespace):
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._check_namespace(namespace)
+            self._entries[self._next_id] = (time.monotonic() + self.ttl, vector, frozenset(chunk_ids), answer)
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "max_distance": self.max_distance
+            }
+
+
+class _Flight:
+    """一次进行中的计算：同步路径用 event 等结果，异步路径用 task"""
+
+    def __init__(self, task=None):
+        self.event = threading.Event()
+        self.task = task
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    请求合并 (singleflight)：同一个键同时只算一次，并发进来的相同调用等这一次的结果
+    - 和缓存的区别：只合并"正在进行中"的调用，算完就忘，不存结果
+    - 键的第一项是阶段名，按阶段统计合并比例 (coalesced / 总调用数)
+    - 同步 (do) 和异步 (ado) 各有一张表，互不合并
+    - 异步路径：等待方被取消不影响别人；所有等待方都走了才取消底层计算
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self._stages = {}  # 阶段名 -> [实际执行次数, 合并次数]
+
+    def _count(self, key, coalesced: bool):
+        # 调用方需持有锁
+        item = self._stages.setdefault(key[0], [0, 0])
+        item[1 if coalesced else 0] += 1
+        if coalesced:
+            print(f"🔗 [Singleflight] {key[0]} 合并到进行中的相同调用")
+
+    def do(self, key, fn):
+        """[同步] 第一个进来的执行 fn()，其余的等它的结果 (异常也一起共享)"""
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight()
+            self._count(key, coalesced=not leader)
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.event.set()
+
+    async def ado(self, key, factory):
+        """[异步] factory() 返回协程；第一个进来的把它包成 task，所有人一起 await"""
+        if not self.enabled:
+            return await factory()
+        with self._lock:
+            flight = self._async_calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._async_calls[key] = _Flight(asyncio.ensure_future(factory()))
+                flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self._count(key, coalesced=not leader)
+            flight.waiters += 1
+        try:
+            # shield：某个等待方被取消时，不能把大家共享的 task 一起取消
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._async_calls.get(key) is flight:
+                del self._async_calls[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {}
+            for stage, (executed, coalesced) in self._stages.items():
+                stages[stage] = {
+                    "executed": executed,
+                    "coalesced": coalesced,
+                    "coalescing_ratio": round(coalesced / (executed + coalesced), 4) if executed + coalesced else 0.0
+                }
+            executed = sum(item["executed"] for item in stages.values())
+            coalesced = sum(item["coalesced"] for item in stages.values())
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "coalescing_ratio": round(coalesced / (executed + coalesced), 4) if executed + coalesced else 0.0,
+                "stages": stages
+            }
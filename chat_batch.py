@@ -0,0 +1,126 @@
+import time
+import uuid
+import asyncio
+import config
+from caching import normalize_query
+from metrics import collect_stage_timings
+from securag_engine import INJECTION_BLOCK_MSG
+from admission import Overloaded
+
+# ==========================================
+# 批量问答 (/chat/batch)：回归测试 / 批量出报告用
+# - 去重：同一会话里 (归一化后) 一样的问题只跑一次，重复的直接复用结果
+# - 一次扫描：先把所有问题过一遍注入规则，命中的当场返回，不占并发名额
+# - 同一个 session_id 的问题按顺序跑 (后面的问题依赖前面的历史)，不同会话并发跑，最多 concurrency 个
+# - 每条都单独找准入控制要名额 (和 /chat 一样排队、一样受 CHAT_MAX_CONCURRENT 限制)，
+#   一个批次绕不过并发上限；排不上的那条返回 overloaded + retry_after，其余照常跑
+# - 结果按完成顺序一条条吐出来 (NDJSON)，每条带各阶段耗时
+# ==========================================
+
+
+def plan_batch(items: list, batch_id: str) -> tuple:
+    """
+    去重 + 按会话分组
+    返回 (groups: {会话: [条目下标]}, duplicates: {首次出现的下标: [重复条目的下标]}, sessions: {下标: 会话})
+    没给 session_id 的条目各自用一个独立的新会话，互不影响
+    """
+    first_seen = {}
+    groups = {}
+    duplicates = {}
+    sessions = {}
+    for index, item in enumerate(items):
+        key = (normalize_query(item["query"]), item.get("session_id"))
+        if key in first_seen:
+            duplicates[first_seen[key]].append(index)
+            continue
+        first_seen[key] = index
+        duplicates[index] = []
+        session_id = item.get("session_id") or f"batch-{batch_id}-{index}"
+        sessions[index] = session_id
+        groups.setdefault(session_id, []).append(index)
+    return groups, duplicates, sessions
+
+
+async def run_batch(bot, items: list, temperature: float = 0.1, concurrency: int = None, admission=None):
+    """
+    items: [{"query", "session_id" (可选), "id" (可选)}]
+    admission: 准入控制 (AdmissionController)，每条跑引擎之前要拿一个名额；不传就不限
+    按完成顺序 yield 每一条的结果:
+    {"index", "id", "session_id", "status": success|error, "answer", "route", "chunks",
+     "timings_ms": {阶段: 毫秒, "queue": 排队 (含等准入名额), "total": 总计}, "duplicate_of": 重复条目指向的下标}
+    准入排不上的条目: {"status": "error", "error": "overloaded: ...", "retry_after": 秒}
+    """
+    concurrency = max(1, min(concurrency or config.CHAT_BATCH_CONCURRENCY, config.CHAT_BATCH_MAX_CONCURRENCY))
+    if admission is not None:
+        # 批内并发超过准入上限也没用，多出来的只会在准入队列里干等、占满队列
+        concurrency = min(concurrency, admission.max_concurrent)
+    batch_id = uuid.uuid4().hex[:8]
+    groups, duplicates, sessions = plan_batch(items, batch_id)
+    print(f"📦 [Batch {batch_id}] {len(items)} 条，去重后 {len(sessions)} 条，{len(groups)} 个会话，并发 {concurrency}")
+
+    results = asyncio.Queue()
+
+    def emit(index: int, result: dict):
+        base = {"index": index, "id": items[index].get("id"), "session_id": sessions[index], **result}
+        results.put_nowait(base)
+        for duplicate in duplicates[index]:
+            results.put_nowait({**base, "index": duplicate, "id": items[duplicate].get("id"), "duplicate_of": index})
+
+    # 一次扫描：所有问题先过注入规则，命中的直接出结果
+    start = time.perf_counter()
+    blocked = {index for index in sessions if bot.guard.check_injection(items[index]["query"])}
+    screen_ms = round((time.perf_counter() - start) * 1000, 2)
+    for index in sorted(blocked):
+        emit(index, {
+            "status": "success", "answer": INJECTION_BLOCK_MSG, "route": "blocked", "chunks": 0,
+            "timings_ms": {"screen": screen_ms, "total": screen_ms}
+        })
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_item(index: int):
+        queued_at = time.perf_counter()
+        async with semaphore:
+            admitted_at = None
+            try:
+                if admission is not None:
+                    admitted_at = await admission.acquire()
+            except Overloaded as e:
+                waited = round((time.perf_counter() - queued_at) * 1000, 2)
+                emit(index, {
+                    "status": "error", "error": f"overloaded: {e.reason}", "retry_after": e.retry_after,
+                    "timings_ms": {"queue": waited, "total": waited}
+                })
+                return
+            started_at = time.perf_counter()
+            try:
+                with collect_stage_timings() as timings:
+                    try:
+                        turn = await bot.achat_turn(items[index]["query"], sessions[index], temperature)
+                        result = {"status": "error" if "error" in turn else "success", **turn}
+                    except Exception as e:
+                        print(f"❌ [Batch {batch_id}] 第 {index} 条失败: {e}")
+                        result = {"status": "error", "error": str(e)}
+            finally:
+                if admitted_at is not None:
+                    admission.release(admitted_at)
+            timings["queue"] = round((started_at - queued_at) * 1000, 2)
+            timings["total"] = round((time.perf_counter() - queued_at) * 1000, 2)
+            result["timings_ms"] = timings
+        emit(index, result)
+
+    async def run_session(indexes: list):
+        # 同一个会话按顺序问，后面的问题才看得到前面的回答
+        for index in indexes:
+            if index not in blocked:
+                await run_item(index)
+
+    tasks = [asyncio.create_task(run_session(indexes)) for indexes in groups.values()]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        # 客户端中途断开：没跑完的条目全部取消
+        for task in tasks:
+            if not task.done():
+                task.cancel()
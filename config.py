@@ -28,4 +28,112 @@ SYSTEM_PROMPT = """
         
         【背景知识】：
         {context}
-        """
\ No newline at end of file
+        """
+# --- 意图路由 (本地向量路由器) ---
+# 原型样本：每类一组典型问法，启动时算出质心
+ROUTER_PROTOTYPES_PATH = "intent_prototypes.json"
+# 质心缓存：样本没改就直接读盘，不用每次启动都重新 embedding
+ROUTER_CENTROIDS_PATH = "./my_local_db/intent_centroids.json"
+# 两类相似度差值低于这个阈值就认为"没把握"，升级给大模型判断
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))
+
+# --- AI 防火墙判决缓存 (LRU + TTL) ---
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "4096"))
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", "3600"))  # 正常判决缓存 1 小时
+VERDICT_CACHE_FAIL_TTL = float(os.getenv("VERDICT_CACHE_FAIL_TTL", "30"))  # 裁判挂了的"放行"只缓存 30 秒
+
+# --- 语义答案缓存 (默认关闭，需要时在 .env 里打开) ---
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+# 余弦距离阈值：越小越严格 (0 = 只有向量完全一样才命中)
+SEMANTIC_CACHE_MAX_DISTANCE = float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", "0.08"))
+
+# --- 会话存储 ---
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" 或 "sqlite" (多 worker / 重启不丢)
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./my_local_db/sessions.db")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))  # 仅内存后端：最多保留多少个会话
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))  # 会话空闲多久过期 (秒)
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "50"))  # 每个会话最多保留多少轮
+SESSION_HISTORY_WINDOW = 4  # Prompt 只用得到最近 4 条消息
+
+# --- 入库 ---
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "128"))  # 每批清洗/向量化/写库的片段数
+INGEST_MAX_CONCURRENT = int(os.getenv("INGEST_MAX_CONCURRENT", "2"))  # 同时跑几个入库任务
+INGEST_JOBS_DB = os.getenv("INGEST_JOBS_DB", "./my_local_db/ingest_jobs.db")  # 任务状态持久化
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))  # 抽取 PDF 文本的进程数，0 = CPU 核数
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))  # 页数少于这个就不开进程池
+INGEST_MANIFEST_DB = os.getenv("INGEST_MANIFEST_DB", "./my_local_db/ingest_manifest.db")  # 来源文件 -> 片段 ID 清单
+
+# --- 检索 (向量 + BM25 混合检索，RRF 融合) ---
+HYBRID_RETRIEVAL_ENABLED = os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))  # 最终送给大模型的片段数
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "10"))  # 每一路 (向量 / BM25) 先各取多少个候选
+RRF_K = int(os.getenv("RRF_K", "60"))  # RRF 平滑常数，越大名次差异的影响越小
+# 向量检索微批：并发请求在这个窗口内攒成一批一起查 (毫秒，0 = 不攒批)，一批最多多少个查询
+RETRIEVAL_BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "5"))
+RETRIEVAL_MAX_BATCH_SIZE = int(os.getenv("RETRIEVAL_MAX_BATCH_SIZE", "16"))
+
+# --- 规则筛查 (注入指令 + 危险关键词，一次扫描) ---
+SCREENING_RULES_PATH = os.getenv("SCREENING_RULES_PATH", "screening_rules.json")  # 改这个文件会自动热更新
+SCREENING_RELOAD_INTERVAL = float(os.getenv("SCREENING_RELOAD_INTERVAL", "2"))  # 最多每几秒检查一次文件有没有改
+
+# --- Presidio 批量 PII 分析 ---
+PRESIDIO_BATCH_SIZE = int(os.getenv("PRESIDIO_BATCH_SIZE", "32"))  # 每批送进 spaCy nlp.pipe 的文本数
+PRESIDIO_N_PROCESS = int(os.getenv("PRESIDIO_N_PROCESS", "1"))  # nlp.pipe 的进程数 (每个进程各加载一份模型)
+PRESIDIO_SCORE_THRESHOLD = float(os.getenv("PRESIDIO_SCORE_THRESHOLD", "0.6"))  # 低于这个置信度的实体不算
+# 入库时的 PII 处理: "off" = 不跑 Presidio, "scan" = 只统计报告, "anonymize" = 把识别出的实体替换掉再入库
+INGEST_PII_MODE = os.getenv("INGEST_PII_MODE", "off")
+
+# --- Presidio 安检配置 ---
+# "full" = en_core_web_lg 全量流水线 (默认)；"light" = 小模型 + 去掉依存句法 + 预筛 (没有大写/数字/@ 就跳过 NER)
+GUARD_PROFILE = os.getenv("GUARD_PROFILE", "full")
+GUARD_LIGHT_MODEL = os.getenv("GUARD_LIGHT_MODEL", "en_core_web_sm")
+
+# --- Presidio PII 审计策略 ---
+# "audit" = 后台线程异步审计，只写日志不拦截 (请求零额外延迟，默认)
+# "enforce" = 同步审计，检测到敏感信息就拦截；"off" = 不审计
+PII_AUDIT_MODE = os.getenv("PII_AUDIT_MODE", "audit")
+PII_AUDIT_LOG = os.getenv("PII_AUDIT_LOG", "./logs/pii_audit.jsonl")  # 结构化审计日志 (JSON Lines)
+PII_AUDIT_QUEUE_SIZE = int(os.getenv("PII_AUDIT_QUEUE_SIZE", "1000"))  # 队列满了新来的直接丢弃，不反压请求
+PII_AUDIT_BATCH_SIZE = int(os.getenv("PII_AUDIT_BATCH_SIZE", "16"))  # 后台每次最多攒多少条一起分析
+
+# --- /chat 准入控制 (背压) ---
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "8"))  # 同时跑引擎的请求数
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))  # 最多排队多少个，再多直接 429
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))  # 排队超过这么久也 429
+# /chat/batch：每条单独占一个准入名额 (和 /chat 共用上面的并发上限)，批内最多同时跑几条
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "4"))
+CHAT_BATCH_MAX_CONCURRENCY = int(os.getenv("CHAT_BATCH_MAX_CONCURRENCY", "16"))  # 请求里 concurrency 的上限
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "1000"))  # 一批最多多少条
+
+# --- 多 worker 服务 (serve.py：主进程预加载，再 fork 出 worker) ---
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "2"))
+SERVER_MEMORY_REPORT_INTERVAL = float(os.getenv("SERVER_MEMORY_REPORT_INTERVAL", "60"))  # 每隔多久打印一次各 worker 内存
+INGEST_RESUME_ON_START = True  # 启动时恢复没跑完的入库任务 (serve.py 只让第一个 worker 做)
+INGEST_RESUME_OWNER = None  # 只恢复这个进程 (pid) 名下的任务；None = 全部 (serve.py 拉起挂掉的 worker 时设成旧 worker 的 pid)
+
+# --- LLM HTTP 传输层 (连接池 / 分阶段超时 / 重试 / 对冲请求) ---
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))  # 连接池最多多少个连接
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))  # 空闲时最多留多少个 keep-alive 连接
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))  # 空闲连接保留多久 (秒)
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))  # 建连接超时
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))  # 连接池满了，等空闲连接的超时
+# 各阶段的读超时 (秒)：可以用 LLM_TIMEOUT_FIREWALL 这样的环境变量单独改
+LLM_STAGE_TIMEOUTS = {
+    stage: float(os.getenv(f"LLM_TIMEOUT_{stage.upper()}", default))
+    for stage, default in {"firewall": "20", "rewrite": "30", "intent": "20", "generate": "180"}.items()
+}
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # 超时 / 连接失败 / 429 / 5xx 最多重试几次
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # 退避基数 (秒)，每次翻倍再加随机抖动
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# 对冲请求 (默认关闭)：短分类调用超过 LLM_HEDGE_DELAY 秒没回来就再发一份，谁快用谁 (会多花 token)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "1.0"))
+LLM_HEDGE_STAGES = set(os.getenv("LLM_HEDGE_STAGES", "firewall,intent").split(","))
+LLM_HEDGE_MAX_WORKERS = int(os.getenv("LLM_HEDGE_MAX_WORKERS", "16"))  # 同步路径上备份请求的线程池大小 (主请求不占这个池子)
+
+# --- 请求合并 (singleflight)：同一时刻的相同调用只算一次 ---
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
@@ -44,7 +44,7 @@ with st.sidebar:
                 f.write(uploaded_file.getbuffer())
             
             # 2. 调用昨天的 pdf_loader 进行入库
-            load_pdf_to_chroma(temp_path)
+            load_pdf_to_chroma(temp_path, bot=st.session_state.bot, source=uploaded_file.name)
             
             # 3. 删掉临时文件
             os.remove(temp_path)
@@ -3,6 +3,7 @@ import requests
 import uuid
 import time # 用来模拟一点点延迟，让动画更好看
 import os
+import json
 
 # --- 1. 页面基本配置 ---
 st.set_page_config(
@@ -17,6 +18,16 @@ st.set_page_config(
 DEFAULT_API_URL = "http://127.0.0.1:8000"
 BASE_URL = os.getenv("API_BASE_URL", DEFAULT_API_URL)
 API_URL = f"{BASE_URL}/chat"
+STREAM_URL = f"{BASE_URL}/chat/stream"
+# 入库进度最多轮询多久 (秒)，超时就不等了 (任务还在后台跑，可以稍后再看)
+INGEST_POLL_TIMEOUT = float(os.getenv("INGEST_POLL_TIMEOUT", "600"))
+
+def iter_sse(response):
+    """把 /chat/stream 的 Server-Sent Events 逐个解析成字典"""
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith("data: "):
+            yield json.loads(line[len("data: "):])
 
 # --- 2. 初始化会话 ---
 if "session_id" not in st.session_state:
@@ -77,13 +88,42 @@ with st.sidebar:
                     
                     # 2. 发送请求给刚才写的 /upload 接口
                     # 注意：上传文件不需要 json=payload，而是 files=files
-                    response = requests.post(f"{BASE_URL}/upload", files=files, timeout=300)
+                    # 后端只负责收文件并排队，马上就会返回 job_id
+                    response = requests.post(f"{BASE_URL}/upload", files=files, timeout=60)
                     
                     # 3. 处理结果
                     if response.status_code == 200:
                         data = response.json()
-                        if data.get("status") == "success":
-                            st.success(f"✅ {data['msg']}")
+                        if data.get("status") == "queued":
+                            # 4. 轮询 /jobs/{job_id}，用进度条展示入库进度
+                            job_id = data["job_id"]
+                            progress = st.progress(0.0, text="排队中...")
+                            deadline = time.monotonic() + INGEST_POLL_TIMEOUT
+                            job, failure = None, None
+                            while True:
+                                job_response = requests.get(f"{BASE_URL}/jobs/{job_id}", timeout=5)
+                                if job_response.status_code != 200:
+                                    # 404: 任务不存在 (比如后端换了任务库)，别的状态码也没法继续等
+                                    failure = f"入库失败: 查询任务进度失败 (HTTP {job_response.status_code})"
+                                    break
+                                job = job_response.json()
+                                if job["chunks_total"]:
+                                    progress.progress(
+                                        min(job["chunks_done"] / job["chunks_total"], 1.0),
+                                        text=f"{job['chunks_done']}/{job['chunks_total']} 片段 ({job['chunks_per_sec']} 片段/秒)"
+                                    )
+                                if job["state"] in ("done", "failed"):
+                                    break
+                                if time.monotonic() >= deadline:
+                                    failure = f"入库超时: 等了 {INGEST_POLL_TIMEOUT:.0f} 秒还没完成 (当前状态: {job['state']})，任务 {job_id} 仍在后台处理，请稍后刷新"
+                                    break
+                                time.sleep(1)
+                            if failure:
+                                st.error(f"❌ {failure}")
+                            elif job["state"] == "done":
+                                st.success(f"✅ 知识库入库成功！共 {job['chunks_total']} 个片段")
+                            else:
+                                st.error(f"❌ 入库失败: {job['error']}")
                         else:
                             st.error(f"❌ 入库失败: {data['msg']}")
                     else:
@@ -123,6 +163,7 @@ if prompt := st.chat_input("请输入问题..."):
         error_msg = ""
 
         # 创建一个状态容器
+        stream_response = None
         with st.status("🔍 正在进行多层安全审计...", expanded=True) as status:
             try:
                 st.write("Checking Deterministic Rules (Regex)...")
@@ -137,25 +178,16 @@ if prompt := st.chat_input("请输入问题..."):
                     "session_id": st.session_state.session_id, 
                     "temperature": current_temp
                 }
-                response = requests.post(API_URL, json=payload, timeout=60)
+                # 流式请求：第一个 token 到了就开始显示，不用干等整段回答
+                # timeout=(连接超时, 两段数据之间的最长间隔)
+                stream_response = requests.post(STREAM_URL, json=payload, stream=True, timeout=(5, 120))
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    # [修改点 2] 这里只赋值，不显示！
-                    final_answer = data.get("answer", "")
-                    
-                    # 判断是否被拦截
-                    is_blocked = "Security Alert" in final_answer or "Request denied" in final_answer
-                    
-                    if is_blocked:
-                        # 拦截了：状态栏变红
-                        status.update(label="❌ 威胁已拦截 (Threat Blocked)", state="error", expanded=False)
-                    else:
-                        # 通过了：状态栏变绿，并自动收起
-                        status.update(label="✅ 安全检查通过 (Safe)", state="complete", expanded=False)
+                if stream_response.status_code == 200:
+                    status.update(label="🤖 正在生成回答 (Streaming)...", state="running", expanded=False)
                 else:
                     status.update(label="⚠️ API Server Error", state="error")
-                    error_msg = f"Server returned {response.status_code}"
+                    error_msg = f"Server returned {stream_response.status_code}"
+                    stream_response = None
                     
             except Exception as e:
                 status.update(label="❌ Connection Failed", state="error")
@@ -163,17 +195,37 @@ if prompt := st.chat_input("请输入问题..."):
 
         # [修改点 3] 关键！这里【取消缩进】了！
         # 此时已经跳出了 with st.status 的管辖范围，内容会显示在折叠框的【下面】
-        
+        if stream_response is not None:
+            answer_placeholder = st.empty()
+            route = None
+            try:
+                for event in iter_sse(stream_response):
+                    if event["type"] == "token":
+                        final_answer += event["content"]
+                        answer_placeholder.markdown(final_answer + "▌")  # 打字机效果
+                    elif event["type"] == "error":
+                        error_msg = event["content"]
+                    elif event["type"] == "done":
+                        route = event["route"]
+            except Exception as e:
+                error_msg = str(e)
+
+            # 判断是否被拦截 (以服务端的 done 事件为准)
+            is_blocked = route == "blocked"
+            if is_blocked:
+                # 拦截了：状态栏变红，显示大红框
+                status.update(label="❌ 威胁已拦截 (Threat Blocked)", state="error", expanded=False)
+                answer_placeholder.error(final_answer, icon="🚨")
+            else:
+                # 通过了：状态栏变绿
+                status.update(label="✅ 安全检查通过 (Safe)", state="complete", expanded=False)
+                answer_placeholder.markdown(final_answer)
+
         if error_msg:
             st.error(error_msg)
         
-        elif final_answer:
-            if is_blocked:
-                # 如果是被拦截的，显示大红框
-                st.error(final_answer, icon="🚨")
-            else:
-                # 如果是正常的，直接显示文字 (这样就不用点开折叠框了！)
-                st.markdown(final_answer)
+        if final_answer:
+            if not is_blocked:
                 # 加个小注脚增加专业感
                 st.caption(f"🔧 Temp: {current_temp} | Mode: Local Privacy")
 
@@ -0,0 +1,50 @@
+import re
+import spacy
+from presidio_analyzer import AnalyzerEngine
+from presidio_analyzer.nlp_engine import SpacyNlpEngine
+import config
+
+# Presidio 安检的两套配置
+# - full:  en_core_web_lg 全量流水线，每句话都跑 NER (原来的行为)
+# - light: 小模型 + 去掉 PII 检测用不到的组件 (依存句法) + 廉价预筛，没有"像实体"的字符就不跑 NER
+GUARD_PROFILES = {
+    "full": {"model": "en_core_web_lg", "exclude": [], "prefilter": False},
+    "light": {"model": config.GUARD_LIGHT_MODEL, "exclude": ["parser", "senter"], "prefilter": True},
+}
+
+# 预筛：大写字母 (人名/地名/机构)、数字 (电话/证件/卡号)、@ (邮箱)、域名样式 (网址)
+# 一个都没有的句子，NER 和正则识别器也找不出东西，直接跳过
+_ENTITY_CANDIDATE = re.compile(r"[A-Z]|\d|@|\w\.[a-zA-Z]{2,}")
+
+
+def has_entity_candidates(text: str) -> bool:
+    return _ENTITY_CANDIDATE.search(text) is not None
+
+
+class _TrimmedSpacyNlpEngine(SpacyNlpEngine):
+    """加载 spaCy 模型时直接排除不需要的组件 (exclude 的组件权重不会进内存)"""
+
+    def __init__(self, models: list, exclude: list):
+        super().__init__(models=models)
+        self.exclude = exclude
+
+    def load(self):
+        self.nlp = {
+            model["lang_code"]: spacy.load(model["model_name"], exclude=self.exclude)
+            for model in self.models
+        }
+
+
+def build_analyzer(profile: str) -> AnalyzerEngine:
+    """按安检配置创建 Presidio 分析器"""
+    if profile not in GUARD_PROFILES:
+        raise ValueError(f"未知的安检配置: {profile} (可选: {', '.join(GUARD_PROFILES)})")
+    if profile == "full":
+        return AnalyzerEngine()
+    spec = GUARD_PROFILES[profile]
+    nlp_engine = _TrimmedSpacyNlpEngine(
+        models=[{"lang_code": "en", "model_name": spec["model"]}],
+        exclude=spec["exclude"]
+    )
+    nlp_engine.load()
+    return AnalyzerEngine(nlp_engine=nlp_engine, supported_languages=["en"])
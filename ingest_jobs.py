@@ -0,0 +1,131 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+from pdf_loader import load_pdf_to_chroma
+
+
+class IngestJobQueue:
+    """
+    后台入库任务队列
+    - /upload 只负责存文件 + 登记任务，立刻返回 job_id
+    - 解析 / 切片 / 向量化在有界线程池里跑 (最多 max_concurrent 个任务同时进行)
+    - 任务状态落在 SQLite 里：服务重启后，没跑完的任务会重新排队
+    - 每个任务记着是哪个进程 (owner = pid) 在跑：多 worker 部署时某个 worker 挂了，
+      拉起来的新 worker 只接手旧 worker 名下的任务 (resume_owner)
+    状态流转: queued -> running -> done / failed
+    """
+
+    def __init__(self, bot, db_path: str = None, max_concurrent: int = None, resume: bool = True,
+                 resume_owner: int = None):
+        self.bot = bot
+        self.db_path = db_path or config.INGEST_JOBS_DB
+        self.max_concurrent = max_concurrent or config.INGEST_MAX_CONCURRENT
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                path TEXT NOT NULL,
+                state TEXT NOT NULL,
+                chunks_done INTEGER NOT NULL DEFAULT 0,
+                chunks_total INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner INTEGER
+            )
+        """)
+        # 老版本建的表没有 owner 列，补上 (多个 worker 同时启动时可能别人刚加过)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(ingest_jobs)")}
+        if "owner" not in columns:
+            try:
+                self._conn.execute("ALTER TABLE ingest_jobs ADD COLUMN owner INTEGER")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise
+        self._conn.commit()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="ingest")
+        # 多 worker 部署时只让一个 worker 恢复任务，不然同一个任务会被跑好几遍
+        if resume:
+            self._resume(resume_owner)
+
+    def _update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE ingest_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _resume(self, owner: int = None):
+        """
+        上次没跑完的任务 (排队中 / 跑到一半服务挂了) 重新排队，接到自己名下
+        owner: 只接手这个进程名下的任务 (挂掉的 worker 的 pid)；None = 全部
+        """
+        query = "SELECT id FROM ingest_jobs WHERE state IN ('queued', 'running')"
+        params = ()
+        if owner is not None:
+            query += " AND owner = ?"
+            params = (owner,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at", params).fetchall()
+        for row in rows:
+            self._update(row["id"], state="queued", chunks_done=0, started_at=None, owner=os.getpid())
+            self._executor.submit(self._run, row["id"])
+        if rows:
+            print(f"♻️ [Ingest] 恢复了 {len(rows)} 个未完成的入库任务" + (f" (来自 pid {owner})" if owner is not None else ""))
+
+    def submit(self, path: str, filename: str) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO ingest_jobs (id, filename, path, state, created_at, owner) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, filename, path, time.time(), os.getpid())
+            )
+        self._executor.submit(self._run, job_id)
+        print(f"📨 [Ingest] 任务已排队: {job_id} ({filename})")
+        return job_id
+
+    def _run(self, job_id: str):
+        job = self.get(job_id)
+        if job is None:
+            return
+        self._update(job_id, state="running", started_at=time.time())
+
+        def on_progress(done, total):
+            self._update(job_id, chunks_done=done, chunks_total=total)
+
+        try:
+            stats = load_pdf_to_chroma(job["path"], bot=self.bot, on_progress=on_progress, source=job["filename"])
+            if stats is None:
+                raise FileNotFoundError(f"文件不存在: {job['path']}")
+            self._update(job_id, state="done", finished_at=time.time(),
+                         chunks_done=stats["chunks"], chunks_total=stats["chunks"])
+        except Exception as e:
+            print(f"❌ [Ingest] 任务 {job_id} 失败: {e}")
+            self._update(job_id, state="failed", error=str(e), finished_at=time.time())
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        # 吞吐量：已处理片段数 / 已运行时间
+        if job["started_at"]:
+            elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+            job["chunks_per_sec"] = round(job["chunks_done"] / elapsed, 1) if elapsed > 0 else 0.0
+        else:
+            job["chunks_per_sec"] = 0.0
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM ingest_jobs GROUP BY state").fetchall()
+        return {"max_concurrent": self.max_concurrent, **{state: count for state, count in rows}}
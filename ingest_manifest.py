@@ -0,0 +1,115 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+def file_sha256(path: str) -> str:
+    """文件内容哈希 (分块读，大文件也不占内存)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(clean_doc: str) -> str:
+    """
+    片段 ID = 内容的 SHA-256
+    (Python 自带的 hash() 每个进程随机加盐，重启后同一段文字 ID 就变了，会重复入库)
+    """
+    return hashlib.sha256(clean_doc.encode("utf-8")).hexdigest()
+
+
+class IngestManifest:
+    """
+    入库清单：每个来源文件 -> (文件哈希, 它产生的片段 ID 列表)
+    - 文件哈希没变 -> 重新上传直接跳过
+    - 文件变了 -> 只加新片段，删掉不再需要的旧片段 (其他文件还在引用的片段不删)
+    顺便存知识库版本号：任何入库/删除都 +1，依赖检索结果的缓存 (语义答案缓存、请求合并) 靠它失效；
+    放在 SQLite 里而不是进程内存里，serve.py 的多个 worker 看到的是同一个版本号
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                source TEXT PRIMARY KEY,
+                file_sha256 TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS source_chunks (
+                source TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (source, chunk_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_source_chunks_chunk ON source_chunks(chunk_id);
+            CREATE TABLE IF NOT EXISTS collection_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+        """)
+        self._conn.commit()
+        # 版本号单独一个只读连接 + 单独的锁：每个请求 (包括事件循环上) 都要读它，
+        # 不能跟着入库时 replace() / shared_ids() 的大事务一起排队；WAL 模式下读不会被写挡住
+        self._version_lock = threading.Lock()
+        self._version_conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._version_conn.execute("PRAGMA query_only = ON")
+
+    def file_hash(self, source: str):
+        with self._lock:
+            row = self._conn.execute("SELECT file_sha256 FROM sources WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def chunk_ids(self, source: str) -> set:
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM source_chunks WHERE source = ?", (source,)).fetchall()
+        return {row[0] for row in rows}
+
+    def shared_ids(self, source: str, candidate_ids) -> set:
+        """candidate_ids 里哪些还被别的来源引用着 (这些不能删)"""
+        candidate_ids = list(candidate_ids)
+        shared = set()
+        with self._lock:
+            for start in range(0, len(candidate_ids), 500):
+                batch = candidate_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT chunk_id FROM source_chunks WHERE source != ? AND chunk_id IN ({placeholders})",
+                    (source, *batch)
+                ).fetchall()
+                shared.update(row[0] for row in rows)
+        return shared
+
+    def replace(self, source: str, file_sha256: str, chunk_ids):
+        """一个事务里把来源的清单整体换掉"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM source_chunks WHERE source = ?", (source,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO source_chunks (source, chunk_id) VALUES (?, ?)",
+                [(source, cid) for cid in chunk_ids]
+            )
+            self._conn.execute(
+                "INSERT INTO sources (source, file_sha256, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(source) DO UPDATE SET file_sha256 = excluded.file_sha256, updated_at = excluded.updated_at",
+                (source, file_sha256, time.time())
+            )
+
+    def collection_version(self, name: str) -> int:
+        with self._version_lock:
+            row = self._version_conn.execute("SELECT version FROM collection_versions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_collection_version(self, name: str) -> int:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO collection_versions (name, version) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+                (name,)
+            )
+            return self._conn.execute("SELECT version FROM collection_versions WHERE name = ?", (name,)).fetchone()[0]
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+import config
+
+
+class IntentRouter:
+    """
+    本地意图路由器 (Nearest-Centroid)
+    用知识库同款的 embedding 函数把问题向量化，跟 SEARCH / CHAT 两组原型样本的质心比余弦相似度。
+    两类差距足够大 -> 直接本地判定 (毫秒级)；差距太小 -> 返回 None，让引擎升级给大模型。
+    """
+
+    def __init__(self, embedding_function, prototypes_path: str = None,
+                 centroids_path: str = None, margin: float = None):
+        self.embedding_function = embedding_function
+        self.prototypes_path = prototypes_path or config.ROUTER_PROTOTYPES_PATH
+        self.centroids_path = centroids_path or config.ROUTER_CENTROIDS_PATH
+        self.margin = config.ROUTER_MARGIN if margin is None else margin
+
+        self.labels = []
+        self.centroids = None  # shape: (类别数, 向量维度)，已归一化
+        self._lock = threading.Lock()
+        self._total = 0
+        self._escalated = 0
+        self._latency_total = 0.0
+        self._load_centroids()
+
+    def _embed(self, texts: list) -> np.ndarray:
+        vectors = np.asarray(self.embedding_function(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _embedder_signature(self) -> dict:
+        """
+        embedding 函数的身份：Chroma 的 embedding 函数都有 name() + get_config() (模型名等)；
+        自定义函数拿不到的话，退回 类名 + 向量维度
+        """
+        ef = self.embedding_function
+        try:
+            return {"name": ef.name(), "config": ef.get_config()}
+        except Exception:
+            cls = type(ef)
+            return {"name": f"{cls.__module__}.{cls.__qualname__}", "dim": int(self._embed(["dimension probe"]).shape[1])}
+
+    def _load_centroids(self):
+        """
+        优先读质心缓存；原型样本改过、或者换了 embedding 模型 (指纹对不上) 就重新计算并写回硬盘
+        (质心在哪个向量空间里算的就只能在哪个空间里用，换了模型还用旧质心，路由结果全是错的)
+        """
+        with open(self.prototypes_path, "r", encoding="utf-8") as f:
+            prototypes = json.load(f)
+        # 过一遍 JSON：配置里有不能序列化的值也能进指纹，和缓存文件里读回来的也能直接比
+        embedder = json.loads(json.dumps(self._embedder_signature(), default=str))
+        fingerprint = hashlib.sha256(
+            json.dumps({"prototypes": prototypes, "embedder": embedder}, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+        if os.path.exists(self.centroids_path):
+            try:
+                with open(self.centroids_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("fingerprint") == fingerprint:
+                    self.labels = cached["labels"]
+                    self.centroids = np.asarray(cached["centroids"], dtype=np.float32)
+                    print(f"🧭 [Router] 已加载质心缓存: {self.labels}")
+                    return
+                if "embedder" in cached and cached["embedder"] != embedder:
+                    print(f"⚠️ [Router] embedding 函数变了 ({cached.get('embedder')} -> {embedder})，质心缓存作废")
+            except Exception as e:
+                print(f"⚠️ [Router] 质心缓存损坏，重新计算: {e}")
+
+        print("🧭 [Router] 正在计算意图原型质心...")
+        labels = sorted(prototypes.keys())
+        centroids = []
+        for label in labels:
+            centroid = self._embed(prototypes[label]).mean(axis=0)
+            centroids.append(centroid / (np.linalg.norm(centroid) or 1.0))
+        self.labels = labels
+        self.centroids = np.stack(centroids)
+
+        os.makedirs(os.path.dirname(self.centroids_path) or ".", exist_ok=True)
+        with open(self.centroids_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "fingerprint": fingerprint,
+                "embedder": embedder,
+                "labels": self.labels,
+                "centroids": self.centroids.tolist()
+            }, f)
+
+    def route(self, user_query: str):
+        """
+        返回 'SEARCH' / 'CHAT'；没把握时返回 None (需要升级给大模型)
+        """
+        start = time.perf_counter()
+        scores = self.centroids @ self._embed([user_query])[0]
+        order = np.argsort(scores)[::-1]
+        best, second = scores[order[0]], scores[order[1]]
+        confident = (best - second) >= self.margin
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._total += 1
+            self._latency_total += elapsed
+            if not confident:
+                self._escalated += 1
+
+        print(f"🧭 [Router] {self.labels[order[0]]} (margin={best - second:.3f}, {elapsed * 1000:.1f}ms)")
+        return self.labels[order[0]] if confident else None
+
+    def stats(self) -> dict:
+        """升级率统计：用来调 ROUTER_MARGIN 阈值"""
+        with self._lock:
+            total = self._total
+            return {
+                "total": total,
+                "local": total - self._escalated,
+                "escalated": self._escalated,
+                "escalation_rate": round(self._escalated / total, 4) if total else 0.0,
+                "avg_latency_ms": round(self._latency_total / total * 1000, 3) if total else 0.0,
+                "margin": self.margin
+            }
@@ -0,0 +1,160 @@
+import re
+import math
+import time
+import threading
+from collections import Counter
+from caching import normalize_query
+
+# 英文 / 数字 / 型号 (AMOGEL、gpt-4o、arXiv 编号 2401.01234 这种中间带 . - _ 的也算一个词)
+_WORD = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+# 中日韩字符：没有空格分词，按 单字 + 相邻两字 切
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> list:
+    """
+    BM25 分词：NFKC + 大小写折叠后
+    - 拉丁字母/数字按词切
+    - CJK 连续片段切成单字 + 二元组 ("知识库" -> 知 识 库 知识 识库)
+    """
+    text = normalize_query(text)
+    tokens = _WORD.findall(text)
+    for run in _CJK.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    内存倒排索引 (BM25)，和向量库用同一套 chunk id
+    - add / remove 增量更新，本进程入库、删片段时跟着 Chroma 一起改
+    - 从 Chroma 全量重建 (Chroma 才是唯一的数据源)，version 记着重建时的知识库版本号；
+      别的进程 (其他 worker / dashboard / 命令行入库) 改了库，版本号对不上，就在后台重建一份换上
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, version: int = None):
+        self.k1 = k1
+        self.b = b
+        self.version = version  # 索引对应的知识库版本号 (入库清单里的 collection_version)
+        self._postings = {}    # 词 -> {chunk_id: 词频}
+        self._doc_terms = {}   # chunk_id -> Counter (删除时要知道它出现在哪些倒排链上)
+        self._doc_lens = {}    # chunk_id -> 词数
+        self._total_len = 0
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()  # 同一时间只跑一个后台重建
+
+    def add(self, ids: list, documents: list):
+        with self._lock:
+            for doc_id, text in zip(ids, documents):
+                if doc_id in self._doc_terms:
+                    continue
+                terms = Counter(tokenize(text or ""))
+                self._doc_terms[doc_id] = terms
+                self._doc_lens[doc_id] = sum(terms.values())
+                self._total_len += self._doc_lens[doc_id]
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, ids: list):
+        with self._lock:
+            for doc_id in ids:
+                terms = self._doc_terms.pop(doc_id, None)
+                if terms is None:
+                    continue
+                self._total_len -= self._doc_lens.pop(doc_id)
+                for term in terms:
+                    posting = self._postings.get(term)
+                    if posting is None:
+                        continue
+                    posting.pop(doc_id, None)
+                    if not posting:
+                        del self._postings[term]
+
+    def advance_version(self, expected: int, version: int):
+        """本进程的改动已经增量同步进来了：索引正好停在 expected 时直接跟到 version，不用重建"""
+        with self._lock:
+            if self.version == expected:
+                self.version = version
+
+    def rebuild_in_background(self, collection, version: int) -> bool:
+        """
+        索引落后于知识库 version 时调用：后台线程从 Chroma 全量重建，建好后整体换上
+        重建期间查询照常用旧索引；已经有重建在跑就直接返回 False
+        """
+        if not self._rebuild_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                start = time.perf_counter()
+                fresh = build_from_collection(collection, version=version)
+                with self._lock:
+                    self._postings, self._doc_terms = fresh._postings, fresh._doc_terms
+                    self._doc_lens, self._total_len = fresh._doc_lens, fresh._total_len
+                    self.version = fresh.version
+                print(f"🔄 [BM25] 知识库版本 {version}，索引已重建: {len(fresh)} 个片段，"
+                      f"耗时 {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                print(f"❌ [BM25] 索引重建失败: {e}")
+            finally:
+                self._rebuild_lock.release()
+
+        threading.Thread(target=run, name="bm25-rebuild", daemon=True).start()
+        return True
+
+    def search(self, query: str, n_results: int = 10) -> list:
+        """返回 [(chunk_id, 分数)]，按分数从高到低"""
+        query_terms = set(tokenize(query))
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            if not doc_count or not query_terms:
+                return []
+            avg_len = self._total_len / doc_count
+            scores = {}
+            for term in query_terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lens[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:n_results]
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"chunks": len(self._doc_terms), "terms": len(self._postings), "version": self.version,
+                    "rebuilding": self._rebuild_lock.locked()}
+
+
+def build_from_collection(collection, page_size: int = 1000, version: int = None) -> BM25Index:
+    """
+    从 Chroma 集合全量重建倒排索引 (分页读，不一次把整个库拉进内存)
+    version: 开始读之前的知识库版本号；读的过程中库又变了，版本号会再对不上，下次查询再重建
+    """
+    index = BM25Index(version=version)
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        index.add(page["ids"], page["documents"])
+        offset += len(page["ids"])
+    return index
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    倒数排名融合 (RRF)：score(d) = Σ 1 / (k + 名次)
+    rankings: 多路检索结果，每路是按相关度排好序的 chunk id 列表
+    只看名次不看原始分数，向量距离和 BM25 分数量纲不同也能直接合并
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
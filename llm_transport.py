@@ -0,0 +1,252 @@
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+import config
+
+# 值得重试的错误：超时、连不上、限流 (429)、服务端 5xx；4xx 参数错误重试也没用
+RETRYABLE_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+class TransportMetrics:
+    """
+    LLM HTTP 传输层统计 (线程安全)
+    - 连接复用：每发一个请求记一次，其中新建 TCP 连接的记为 new，其余就是复用了连接池里的 keep-alive 连接
+    - 按阶段 (firewall / rewrite / intent / generate) 记 调用数 / 重试 / 超时 / 最终失败 / 对冲
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self._stages = {}
+
+    def _stage(self, stage: str) -> dict:
+        return self._stages.setdefault(stage, {
+            "calls": 0, "retries": 0, "timeouts": 0, "failures": 0, "hedged": 0, "hedge_wins": 0
+        })
+
+    def count(self, stage: str, field: str):
+        with self._lock:
+            self._stage(stage)[field] += 1
+
+    def trace(self, name: str, info: dict):
+        """httpcore 的 trace 回调：每个请求都会发请求头，只有新建连接才会有 connect_tcp"""
+        if name.endswith("send_request_headers.started"):
+            with self._lock:
+                self.requests += 1
+        elif name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.new_connections += 1
+
+    async def atrace(self, name: str, info: dict):
+        self.trace(name, info)
+
+    def stats(self) -> dict:
+        with self._lock:
+            reused = max(0, self.requests - self.new_connections)
+            return {
+                "http_requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "reuse_rate": round(reused / self.requests, 3) if self.requests else 0.0,
+                "stages": {stage: dict(item) for stage, item in self._stages.items()}
+            }
+
+
+def stage_timeout(stage: str) -> httpx.Timeout:
+    """按阶段给超时：连接超时统一，读超时按阶段 (防火墙 / 意图分类要快，生成可以慢)"""
+    read = config.LLM_STAGE_TIMEOUTS.get(stage, config.LLM_STAGE_TIMEOUTS["generate"])
+    return httpx.Timeout(read, connect=config.LLM_CONNECT_TIMEOUT, pool=config.LLM_POOL_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=config.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY
+    )
+
+
+def create_client(base_url: str, api_key: str, trust_env: bool = True, metrics: TransportMetrics = None) -> OpenAI:
+    """
+    带连接池的同步客户端；SDK 自带的重试关掉 (max_retries=0)，统一由 LLMTransport 重试
+    trust_env=False 时绕开系统代理 (本地 Ollama 用)
+    """
+    def on_request(request):
+        if metrics is not None:
+            request.extensions["trace"] = metrics.trace
+
+    http_client = openai.DefaultHttpxClient(
+        limits=_limits(),
+        timeout=stage_timeout("generate"),
+        trust_env=trust_env,
+        event_hooks={"request": [on_request]}
+    )
+    return OpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def create_async_client(base_url: str, api_key: str, trust_env: bool = True, metrics: TransportMetrics = None) -> AsyncOpenAI:
+    """create_client 的异步版本 (异步客户端的回调必须是协程)"""
+    async def on_request(request):
+        if metrics is not None:
+            request.extensions["trace"] = metrics.atrace
+
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=_limits(),
+        timeout=stage_timeout("generate"),
+        trust_env=trust_env,
+        event_hooks={"request": [on_request]}
+    )
+    return AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+
+
+class LLMTransport:
+    """
+    所有 LLM 调用的统一出口：按阶段的超时 + 有限次数的抖动退避重试 + (可选) 对冲请求
+    用法: transport.call("firewall", lambda timeout: client.chat.completions.create(..., timeout=timeout))
+    对冲请求：短小的分类调用 (防火墙 / 意图) 超过 LLM_HEDGE_DELAY 秒还没回来，就再发一份，谁先回来用谁，
+    用一点额外的 token 换掉长尾延迟；生成阶段不对冲 (太贵)
+    """
+
+    def __init__(self, metrics: TransportMetrics = None):
+        self.metrics = metrics or TransportMetrics()
+        self._executor = None  # 同步对冲的备份请求用的线程池，第一次用到才建
+        self._executor_lock = threading.Lock()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """指数退避 + 全抖动；限流时服务端给了 Retry-After 就至少等那么久"""
+        delay = random.uniform(0, min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                delay = max(delay, min(config.LLM_RETRY_MAX_DELAY, float(response.headers.get("retry-after", 0))))
+            except ValueError:
+                pass
+        return delay
+
+    def _should_hedge(self, stage: str) -> bool:
+        return config.LLM_HEDGE_ENABLED and stage in config.LLM_HEDGE_STAGES
+
+    def _give_up(self, stage: str, attempt: int, error: Exception) -> bool:
+        if isinstance(error, openai.APITimeoutError):
+            self.metrics.count(stage, "timeouts")
+        if attempt >= config.LLM_MAX_RETRIES:
+            self.metrics.count(stage, "failures")
+            return True
+        self.metrics.count(stage, "retries")
+        print(f"🔁 [LLM] {stage} 调用失败 ({type(error).__name__})，第 {attempt + 1} 次重试...")
+        return False
+
+    def call(self, stage: str, request):
+        """同步调用；request(timeout) 负责真正发请求"""
+        self.metrics.count(stage, "calls")
+        timeout = stage_timeout(stage)
+        attempt = 0
+        while True:
+            try:
+                if self._should_hedge(stage):
+                    return self._hedged(stage, request, timeout)
+                return request(timeout)
+            except RETRYABLE_ERRORS as e:
+                if self._give_up(stage, attempt, e):
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    async def acall(self, stage: str, request):
+        """异步调用；request(timeout) 返回协程"""
+        self.metrics.count(stage, "calls")
+        timeout = stage_timeout(stage)
+        attempt = 0
+        while True:
+            try:
+                if self._should_hedge(stage):
+                    return await self._ahedged(stage, request, timeout)
+                return await request(timeout)
+            except RETRYABLE_ERRORS as e:
+                if self._give_up(stage, attempt, e):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    @staticmethod
+    def _start_primary(request, timeout) -> Future:
+        """
+        主请求单独起一个线程，立刻开始发 (不进线程池排队)：
+        排队的时间不会算进对冲延迟，也不会因为池子满了把进程里所有分类调用卡成串行
+        (同步请求发出去就没法中途放弃，调用方线程得空着，备份先回来才能直接用备份的结果)
+        """
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(request(timeout))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="llm-primary", daemon=True).start()
+        return future
+
+    def _backup_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=config.LLM_HEDGE_MAX_WORKERS,
+                                                        thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def _hedged(self, stage: str, request, timeout):
+        """[同步] 输掉的那个请求没法中途取消，只能让它在后台跑完 (结果丢掉)"""
+        # Thread.start() 等线程真正跑起来才返回，对冲计时从主请求开始发的时候算起
+        primary = self._start_primary(request, timeout)
+        done, _ = wait([primary], timeout=config.LLM_HEDGE_DELAY)
+        if done:
+            return primary.result()
+        self.metrics.count(stage, "hedged")
+        backup = self._backup_executor().submit(request, timeout)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        self.metrics.count(stage, "hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged(self, stage: str, request, timeout):
+        """[异步] 先回来的赢，另一个直接 cancel (连接还给连接池)"""
+        primary = asyncio.ensure_future(request(timeout))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=config.LLM_HEDGE_DELAY)
+            if done:
+                return primary.result()
+            self.metrics.count(stage, "hedged")
+            backup = asyncio.ensure_future(request(timeout))
+            pending = {primary, backup}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.metrics.count(stage, "hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return self.metrics.stats()
@@ -1,13 +1,11 @@
 import json
-from openai import OpenAI
 import config
 import tools
+from llm_transport import LLMTransport, create_client
 
-#初始化客户端,直接调用config里的配置
-client = OpenAI(
-    api_key = config.API_KEY,
-    base_url = config.BASE_URL
-)
+#初始化客户端,直接调用config里的配置 (和 SecuRAG 共用同一套传输层：连接池、超时、重试)
+transport = LLMTransport()
+client = create_client(config.BASE_URL, config.API_KEY, metrics=transport.metrics)
 
 def chat_loop():
     print("AI Agent 启动ing")
@@ -24,12 +22,13 @@ def chat_loop():
                 break
             messages.append({"role": "user", "content": user_input})#保存用户输入
             #把tools.tools.schema 传给AI，告诉他有什么工具用，让AI根据用户输入和可用工具决定下一步
-            response = client.chat.completions.create(
+            response = transport.call("generate", lambda timeout: client.chat.completions.create(
                 model=config.MODEL_NAME,
                 messages=messages,
                 tools=tools.tools_schema,#tool描述
-                temperature=config.TEMPERATURE
-            )
+                temperature=config.TEMPERATURE,
+                timeout=timeout
+            ))
             #获取AI的回复消息对象
             ai_msg = response.choices[0].message
             #判断AI要不要调用工具？也就是返回的ai_msg中有没有含有tool_calls
@@ -60,10 +59,11 @@ def chat_loop():
                         print(f"错误：找不到工具{func_name}")
                 
                 #把工具交给ai，让他生成最终回复
-                final_response = client.chat.completions.create(
+                final_response = transport.call("generate", lambda timeout: client.chat.completions.create(
                     model=config.MODEL_NAME,
-                    messages=messages
-                )
+                    messages=messages,
+                    timeout=timeout
+                ))
                 #final_response (大盒子)
                     #└── choices (列表盒子)
                     #   └── [0] (第一个盒子)
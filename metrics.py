@@ -0,0 +1,193 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# ==========================================
+# Prometheus 指标 (/metrics 导出)
+# 热路径上只做 observe / inc (微秒级)；缓存命中率这类已经有统计的数据，抓取时再由 EngineCollector 读
+# ==========================================
+STAGE_SECONDS = Histogram(
+    "securag_stage_seconds", "各阶段耗时 (秒)", ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+ROUTES = Counter("securag_route_total", "请求最终走的路线 (blocked / chat / rag)", ["route"])
+RETRIEVED_CHUNKS = Histogram(
+    "securag_retrieved_chunks", "每次 RAG 送进 Prompt 的片段数", buckets=(0, 1, 2, 3, 5, 8, 13, 21)
+)
+LLM_TOKENS = Counter("securag_llm_tokens_total", "大模型返回的 token 用量", ["stage", "kind"])
+IN_FLIGHT = Gauge("securag_requests_in_flight", "正在处理的请求数", ["endpoint"])
+
+_stage_children = {}  # 阶段名 -> 带好 label 的 histogram (省掉每次 labels() 的查找)
+
+
+def observe_stage(stage: str, seconds: float):
+    child = _stage_children.get(stage)
+    if child is None:
+        child = _stage_children[stage] = STAGE_SECONDS.labels(stage)
+    child.observe(seconds)
+
+
+def record_llm_usage(stage: str, usage):
+    """response.usage 里的 prompt / completion token 数 (没有 usage 的响应直接跳过)"""
+    if usage is None:
+        return
+    LLM_TOKENS.labels(stage, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(stage, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+class StageLatency:
+    """
+    分阶段耗时统计 (线程安全)：每个阶段记 调用次数 / 总耗时 / 最大耗时
+    用法: with latency.track("vector"): ...
+    给了 name 的话同时记进 Prometheus 的阶段直方图 (阶段名 = name_stage)
+    """
+
+    def __init__(self, name: str = None):
+        self.name = name
+        self._stages = {}  # 阶段名 -> [次数, 总秒数, 最大秒数]
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        if self.name:
+            observe_stage(f"{self.name}_{stage}", seconds)
+        with self._lock:
+            item = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            item[0] += 1
+            item[1] += seconds
+            item[2] = max(item[2], seconds)
+
+    @contextmanager
+    def track(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+                    "max_ms": round(worst * 1000, 3)
+                }
+                for stage, (count, total, worst) in self._stages.items()
+            }
+
+
+# ==========================================
+# 单个请求的分阶段耗时 (给 /chat/batch 逐条报告用)
+# 用 contextvar 传递：asyncio.create_task / asyncio.to_thread 都会带上当前上下文，
+# 子任务、线程池里记的耗时会记到同一个请求的 dict 里；不管有没有在收集，都会记进 Prometheus 直方图
+# ==========================================
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def collect_stage_timings():
+    """with collect_stage_timings() as timings: ...  结束后 timings = {阶段名: 毫秒}"""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe_stage(stage, seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 2)
+
+
+async def atimed_stage(stage: str, awaitable):
+    """timed_stage 的协程版本：给 asyncio.create_task 包一层"""
+    with timed_stage(stage):
+        return await awaitable
+
+
+def process_memory(pid="self") -> dict:
+    """
+    进程内存 (MB)，读 /proc/<pid>/smaps_rollup (Linux)
+    - rss: 常驻内存 (含和其他进程共享的页)
+    - pss: 共享页按共享进程数均摊后的内存，各 worker 的 pss 加起来 ≈ 实际占用
+    - shared / private: 共享页 (fork 后没被改过的) / 本进程独占的页
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "pss_mb": round(fields.get("Pss", 0.0), 1),
+        "shared_mb": round(fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1)
+    }
+
+
+class EngineCollector:
+    """
+    抓取 /metrics 时才去读各组件已有的 stats()：缓存命中、请求合并、准入队列、连接复用
+    (这些计数本来就在维护，导出时零额外开销)
+    """
+
+    def __init__(self, bot, admission=None):
+        self.bot = bot
+        self.admission = admission
+
+    def _caches(self) -> dict:
+        bot = self.bot
+        caches = {"firewall_verdict": bot.verdict_cache, "screening": bot.guard._screen_cache}
+        if bot.semantic_cache is not None:
+            caches["semantic_answer"] = bot.semantic_cache
+        return caches
+
+    def collect(self):
+        hits = CounterMetricFamily("securag_cache_hits", "缓存命中次数", labels=["cache"])
+        misses = CounterMetricFamily("securag_cache_misses", "缓存未命中次数", labels=["cache"])
+        hit_rate = GaugeMetricFamily("securag_cache_hit_rate", "缓存命中率", labels=["cache"])
+        for name, cache in self._caches().items():
+            stats = cache.stats()
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            hit_rate.add_metric([name], stats["hit_rate"])
+        yield from (hits, misses, hit_rate)
+
+        executed = CounterMetricFamily("securag_singleflight_executed", "请求合并：实际执行次数", labels=["stage"])
+        coalesced = CounterMetricFamily("securag_singleflight_coalesced", "请求合并：被合并的调用次数", labels=["stage"])
+        for stage, stats in self.bot.singleflight.stats()["stages"].items():
+            executed.add_metric([stage], stats["executed"])
+            coalesced.add_metric([stage], stats["coalesced"])
+        yield from (executed, coalesced)
+
+        transport = self.bot.transport.stats()
+        yield CounterMetricFamily("securag_llm_http_requests", "发给大模型的 HTTP 请求数", value=transport["http_requests"])
+        yield CounterMetricFamily("securag_llm_new_connections", "新建的 TCP 连接数", value=transport["new_connections"])
+        retries = CounterMetricFamily("securag_llm_retries", "大模型调用重试次数", labels=["stage"])
+        failures = CounterMetricFamily("securag_llm_failures", "重试后仍失败的大模型调用", labels=["stage"])
+        for stage, stats in transport["stages"].items():
+            retries.add_metric([stage], stats["retries"])
+            failures.add_metric([stage], stats["failures"])
+        yield from (retries, failures)
+
+        if self.admission is not None:
+            stats = self.admission.stats()
+            yield GaugeMetricFamily("securag_admission_in_flight", "准入控制：正在执行的请求", value=stats["in_flight"])
+            yield GaugeMetricFamily("securag_admission_queue_length", "准入控制：排队中的请求", value=stats["queue_length"])
+            yield CounterMetricFamily("securag_admission_rejected", "准入控制：返回 429 的请求", value=stats["rejected"])
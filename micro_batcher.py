@@ -0,0 +1,94 @@
+import time
+import threading
+
+
+class _Slot:
+    def __init__(self, item):
+        self.item = item
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    微批处理 (线程安全)：一个时间窗口内到达的请求攒成一批，调用一次 handler(items)，
+    再把结果按顺序分给各个调用方。
+    - 每批的第一个请求当"领头的"：最多等 window 秒 (或者攒满 max_batch_size 个) 就由它来执行整批，
+      其他请求等结果；所以单个请求最多只多等一个 window
+    - 不开后台线程 (fork 之后也能直接用)
+    - handler 抛异常时，这一批的调用方都收到同一个异常
+    - window <= 0 时不攒批，直接调用
+    """
+
+    def __init__(self, handler, window: float, max_batch_size: int):
+        self.handler = handler
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._cond = threading.Condition()
+        self._batch = []  # 正在攒的这一批
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._wait_total = 0.0
+
+    def submit(self, item):
+        slot = _Slot(item)
+        if self.window <= 0:
+            self._run([slot])
+        else:
+            self._join_batch(slot)
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
+
+    def _join_batch(self, slot: _Slot):
+        start = time.monotonic()
+        with self._cond:
+            batch = self._batch
+            batch.append(slot)
+            leader = len(batch) == 1
+            if len(batch) >= self.max_batch_size:
+                self._batch = []  # 满了，封口，叫醒领头的
+                self._cond.notify_all()
+            if leader:
+                deadline = start + self.window
+                while self._batch is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._batch = []
+                        break
+                    self._cond.wait(remaining)
+                self._wait_total += time.monotonic() - start
+        if leader:
+            self._run(batch)
+        else:
+            slot.event.wait()
+
+    def _run(self, batch: list):
+        try:
+            results = self.handler([slot.item for slot in batch])
+            for slot, result in zip(batch, results):
+                slot.result = result
+        except Exception as e:
+            for slot in batch:
+                slot.error = e
+        finally:
+            with self._cond:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+            for slot in batch:
+                slot.event.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "window_ms": round(self.window * 1000, 1),
+                "max_batch_size": self.max_batch_size,
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "avg_window_wait_ms": round(self._wait_total / self.batches * 1000, 2) if self.batches else 0.0
+            }
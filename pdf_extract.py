@@ -0,0 +1,27 @@
+import time
+from pypdf import PdfReader
+
+# ==========================================
+# PDF 按页抽取文本 (pdf_loader 的进程池在子进程里跑这里的函数)
+# 单独放一个模块、只依赖 pypdf：子进程用 spawn 启动，要重新 import 函数所在的模块，
+# 放在 pdf_loader 里的话每个子进程都得把 SecuRAG / Chroma / Presidio 全 import 一遍
+# ==========================================
+
+
+def extract_page_range(task):
+    """
+    [子进程] 抽取一段连续页面的文本
+    每个子进程自己打开 PDF (PdfReader 对象不能跨进程传)，返回 [(页码, 文本, 耗时秒)]
+    """
+    pdf_path, first, last = task
+    reader = PdfReader(pdf_path)
+    pages = []
+    for page_no in range(first, last):
+        start = time.perf_counter()
+        text = reader.pages[page_no].extract_text() or ""
+        pages.append((page_no, text, time.perf_counter() - start))
+    return pages
+
+
+def page_count(pdf_path) -> int:
+    return len(PdfReader(pdf_path).pages)
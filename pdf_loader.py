@@ -1,9 +1,43 @@
 import os
-from pypdf import PdfReader
+import time
+import bisect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+import config
 from securag_engine import SecuRAG # 👈 引入我们昨天的引擎
+from ingest_manifest import file_sha256
+from metrics import timed_stage
+from pdf_extract import extract_page_range, page_count as pdf_page_count
 
-def load_pdf_to_chroma(pdf_path):
+def extract_pages(pdf_path, workers: int = None) -> list:
+    """
+    按页抽取文本，返回按页码排好序的 [(页码, 文本, 耗时秒)]
+    大文件按页码区间切给进程池并行抽取，小文件直接单进程 (省掉起进程的开销)
+    """
+    page_count = pdf_page_count(pdf_path)
+    workers = workers or config.PDF_EXTRACT_WORKERS or os.cpu_count() or 1
+    if workers <= 1 or page_count < config.PDF_PARALLEL_MIN_PAGES:
+        return extract_page_range((pdf_path, 0, page_count))
+
+    # 每个进程分到约 2 个区间，慢页面不至于拖住整个进程
+    span = max(1, -(-page_count // (workers * 2)))
+    tasks = [(pdf_path, first, min(first + span, page_count)) for first in range(0, page_count, span)]
+    print(f"⚡ 并行抽取 {page_count} 页 ({workers} 个进程, {len(tasks)} 个区间)...")
+    # 用 spawn 起子进程：调用方 (uvicorn / 入库线程池) 是多线程的，fork 出来的子进程
+    # 可能继承别的线程正拿着的锁，直接死锁；spawn 的子进程是全新的解释器，只 import pdf_extract
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # map 按提交顺序返回，拼回去就是原来的页序
+        return [page for pages in pool.map(extract_page_range, tasks) for page in pages]
+
+def load_pdf_to_chroma(pdf_path, bot=None, on_progress=None, source=None, pii_mode=None):
+    """
+    PDF 入库：读取 -> 切片 -> 存入向量库
+    bot: 调用方已经有的 SecuRAG 实例 (API 服务 / 控制台)，不传才新建一个
+    on_progress(已入库片段数, 总片段数): 进度回调 (后台任务队列用)
+    source: 来源名 (入库清单的键)，默认取文件名；临时文件上传时传原始文件名
+    pii_mode: 入库前的 Presidio 处理 ("off" / "scan" / "anonymize")，默认用 config.INGEST_PII_MODE
+    """
     print(f"📄 正在读取文件: {pdf_path}")
     
     # 1. 读取 PDF 文本
@@ -11,12 +45,52 @@ def load_pdf_to_chroma(pdf_path):
         print("❌ 文件不存在！请检查路径。")
         return
 
-    reader = PdfReader(pdf_path)
-    full_text = ""
-    for page in reader.pages:
-        full_text += page.extract_text()
-        
-    print(f"✅ 读取成功，共 {len(full_text)} 个字符。")
+    source = source or os.path.basename(pdf_path)
+    if bot is None:
+        print("🧠 正在唤醒 SecuRAG 引擎...")
+        bot = SecuRAG() # 初始化引擎 (重量级组件走共享注册表，不会重复加载)
+
+    # 文件内容没变 -> 连 PDF 都不用解析，直接跳过
+    file_hash = file_sha256(pdf_path)
+    if bot.manifest.file_hash(source) == file_hash:
+        chunk_count = len(bot.manifest.chunk_ids(source))
+        print(f"⏭️ {source} 内容没有变化，跳过入库。")
+        if on_progress:
+            on_progress(chunk_count, chunk_count)
+        return {"source": source, "skipped": True, "chunks": chunk_count, "added": 0, "deleted": 0}
+
+    start = time.perf_counter()
+    with timed_stage("ingest_extract"):
+        pages = extract_pages(pdf_path)
+    # 记下每页在全文里的起始位置，切片后按位置反查页码；一次 join，不再反复拼接字符串
+    page_starts = []
+    offset = 0
+    for _, text, _ in pages:
+        page_starts.append(offset)
+        offset += len(text) + 1
+    extract_seconds = time.perf_counter() - start
+
+    # 整份文档按页流式脱敏 (所有检测器一遍扫完)：跨页的号码也能抓到，
+    # 切片前就脱敏，不会把半个手机号切进两个片段里漏掉
+    redactor = bot.guard.redactor.stream()
+    parts = []
+    with timed_stage("ingest_redact"):
+        for index, (_, text, _) in enumerate(pages):
+            parts.append(redactor.feed(text if index == 0 else "\n" + text))
+        parts.append(redactor.flush())
+    full_text = "".join(parts)
+    page_starts = redactor.redacted_offsets(page_starts)
+    if redactor.spans:
+        print(f"🙈 入库前脱敏了 {len(redactor.spans)} 处敏感信息。")
+
+    print(f"✅ 读取成功，共 {len(pages)} 页、{len(full_text)} 个字符，耗时 {extract_seconds:.2f}s。")
+    # 找出最慢的几页 (扫描件 / 超复杂排版)，方便排查
+    slowest_pages = [
+        {"page": page_no + 1, "seconds": round(seconds, 3)}
+        for page_no, _, seconds in sorted(pages, key=lambda page: -page[2])[:5]
+    ]
+    if slowest_pages:
+        print(f"🐢 最慢的页面: {slowest_pages}")
     
     # 2. 智能切片 (Chunking)
     # 这是 RAG 的核心技术之一：不能切断句子，要按语义切
@@ -24,24 +98,73 @@ def load_pdf_to_chroma(pdf_path):
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=500,      # 每块约 500 字符
         chunk_overlap=50,    # 每块之间重叠 50 字 (防止切断上下文)
-        separators=["\n\n", "\n", "。", ".", " ", ""] # 优先按段落切
+        separators=["\n\n", "\n", "。", ".", " ", ""], # 优先按段落切
+        add_start_index=True # 记下每块在全文里的位置，用来标注来源页码
     )
     
-    chunks = text_splitter.split_text(full_text)
+    with timed_stage("ingest_split"):
+        documents = text_splitter.create_documents([full_text])
+    chunks = [doc.page_content for doc in documents]
+    metadatas = [
+        {"source": source, "page": bisect.bisect_right(page_starts, doc.metadata["start_index"])}
+        for doc in documents
+    ]
     print(f"🧩 共切分为 {len(chunks)} 个记忆片段。")
+
+    # 2.5 Presidio PII 审计 (可选)：所有片段成批过 spaCy，不再一条一条分析
+    pii_mode = pii_mode or config.INGEST_PII_MODE
+    pii_entities = {}
+    pii_seconds = 0.0
+    if pii_mode in ("scan", "anonymize") and chunks:
+        print(f"🕵️ 正在批量扫描敏感信息 (模式: {pii_mode})...")
+        pii_start = time.perf_counter()
+        with timed_stage("ingest_pii"):
+            if pii_mode == "anonymize":
+                chunks, findings = bot.guard.anonymize_batch(chunks)
+            else:
+                findings = bot.guard.analyze_batch(chunks)
+        pii_seconds = time.perf_counter() - pii_start
+        for found in findings:
+            for res in found:
+                pii_entities[res.entity_type] = pii_entities.get(res.entity_type, 0) + 1
+        rate = len(chunks) / pii_seconds if pii_seconds > 0 else 0.0
+        print(f"🕵️ 扫描完成，耗时 {pii_seconds:.2f}s ({rate:.1f} 片段/秒)，发现: {pii_entities or '无'}")
+
+    if on_progress:
+        on_progress(0, len(chunks))
     
     # 3. 存入向量数据库
-    print("🧠 正在唤醒 SecuRAG 引擎...")
-    bot = SecuRAG() # 初始化引擎
-    
     print("🚀 开始批量入库 (这可能需要一点时间)...")
-    for i, chunk in enumerate(chunks):
-        # 调用我们昨天写的 add_document 方法
-        # 这里的 chunk 就是一段纯文本
-        bot.add_document(doc_text=chunk)
-        print(f"   - 片段 {i+1}/{len(chunks)} 已存入")
-        
-    print("🎉 入库完成！你的 AI 现在读过这本书了。")
+    start = time.perf_counter()
+
+    def report(done, total):
+        elapsed = time.perf_counter() - start
+        print(f"   - 片段 {done}/{total} 已存入 ({done / elapsed:.1f} 片段/秒)")
+        if on_progress:
+            on_progress(done, total)
+
+    # 按批 清洗 + 向量化 + 写库；库里已有的片段不再重复向量化，旧版本多出来的片段删掉
+    with timed_stage("ingest_write"):
+        result = bot.ingest_source(source, file_hash, chunks, metadatas=metadatas, on_batch=report)
+    elapsed = time.perf_counter() - start
+    stats = {
+        "source": source,
+        "skipped": False,
+        "redacted": len(redactor.spans),
+        "pii_mode": pii_mode,
+        "pii_entities": pii_entities,
+        "pii_seconds": round(pii_seconds, 2),
+        "pages": len(pages),
+        "extract_seconds": round(extract_seconds, 2),
+        "slowest_pages": slowest_pages,
+        "chunks": len(chunks),
+        "added": result["added"],
+        "deleted": result["deleted"],
+        "seconds": round(elapsed, 2),
+        "chunks_per_sec": round(len(chunks) / elapsed, 1) if elapsed > 0 else 0.0
+    }
+    print(f"🎉 入库完成！你的 AI 现在读过这本书了。({stats['chunks_per_sec']} 片段/秒)")
+    return stats
 
 if __name__ == "__main__":
     # 这里填你刚才放入 data 文件夹的文件名
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+import config
+from metrics import timed_stage
+
+_STOP = object()  # close() 往队列里塞的结束标记
+
+
+class PIIAuditor:
+    """
+    Presidio PII 审计流水线
+    - audit 模式：查询丢进有界队列就返回 (请求路径零等待)，后台线程成批跑 Presidio，
+      发现敏感信息就写一行 JSON 到审计日志；队列满了直接丢弃并计数，绝不反压到请求上
+    - enforce 模式：调用方同步跑 Presidio 决定拦不拦，结果用 record() 写进同一份日志
+    日志里只记查询的哈希和长度、实体类型和位置，不落原文 (审计日志本身不能变成新的泄露源)
+    整个进程共用一个 (registry.get_pii_auditor)，不要每个引擎各 new 一个：每个实例都带一个后台线程
+    """
+
+    def __init__(self, guard, log_path: str = None, queue_size: int = None, batch_size: int = None):
+        self.guard = guard
+        self.log_path = log_path or config.PII_AUDIT_LOG
+        self.batch_size = batch_size or config.PII_AUDIT_BATCH_SIZE
+        self._queue = queue.Queue(maxsize=queue_size or config.PII_AUDIT_QUEUE_SIZE)
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.flagged = 0
+        self.blocked = 0
+        self._lag_total = 0.0
+        self._lag_count = 0
+        self._closed = False
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        self._worker = threading.Thread(target=self._run, name="pii-audit", daemon=True)
+        self._worker.start()
+
+    def findings(self, results) -> list:
+        """只留置信度够高的实体，转成可以写日志的 dict"""
+        threshold = config.PRESIDIO_SCORE_THRESHOLD
+        return [
+            {"type": res.entity_type, "score": round(res.score, 3), "start": res.start, "end": res.end}
+            for res in results if res.score > threshold
+        ]
+
+    def _write(self, text: str, entities: list, session_id: str, mode: str, action: str, lag: float = 0.0):
+        entry = {
+            "ts": round(time.time(), 3),
+            "session_id": session_id,
+            "mode": mode,
+            "action": action,
+            "text_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "text_length": len(text),
+            "lag_ms": round(lag * 1000, 1),
+            "entities": entities
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._write_lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def submit(self, text: str, session_id: str = None) -> bool:
+        """[audit 模式] 非阻塞入队；队列满了 (或已经关闭) 返回 False (这条就不审了)"""
+        if self._closed:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((text, session_id, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+        with self._stats_lock:
+            self.submitted += 1
+        return True
+
+    def record(self, text: str, results, session_id: str = None, blocked: bool = False):
+        """[enforce 模式] 同步审计的结果写日志"""
+        entities = self.findings(results)
+        with self._stats_lock:
+            self.processed += 1
+            self.blocked += int(blocked)
+            self.flagged += int(bool(entities))
+        if entities:
+            self._write(text, entities, session_id, "enforce", "block" if blocked else "flag")
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # 队列里攒着的一起拿走，一批走一次 nlp.pipe
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [item for item in items if item is not _STOP]
+            try:
+                with timed_stage("pii_audit_batch"):
+                    results = self.guard.analyze_batch([text for text, _, _ in batch])
+                now = time.monotonic()
+                for (text, session_id, enqueued_at), found in zip(batch, results):
+                    entities = self.findings(found)
+                    for entity in entities:
+                        print(f"🚨 [安全警报] 检测到敏感信息: {entity['type']} (置信度 {entity['score']:.2f})")
+                    if entities:
+                        self._write(text, entities, session_id, "audit", "flag", lag=now - enqueued_at)
+                    with self._stats_lock:
+                        self.processed += 1
+                        self.flagged += int(bool(entities))
+                        self._lag_total += now - enqueued_at
+                        self._lag_count += 1
+            except Exception as e:
+                print(f"⚠️ [PII Audit] 后台审计失败: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if len(batch) != len(items):
+                return
+
+    def join(self):
+        """等队列里的审计全部做完 (关停 / 测试用)"""
+        self._queue.join()
+
+    def close(self, timeout: float = 10.0):
+        """不再接新的审计，把队列里已有的做完，停掉后台线程 (可以重复调用)"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)  # 排在已有的审计后面，前面的都做完线程才退出
+        self._worker.join(timeout)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "mode": config.PII_AUDIT_MODE,
+                "closed": self._closed,
+                "log_path": self.log_path,
+                "queue_length": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "processed": self.processed,
+                "flagged": self.flagged,
+                "blocked": self.blocked,
+                "avg_lag_ms": round(self._lag_total / self._lag_count * 1000, 1) if self._lag_count else 0.0
+            }
@@ -0,0 +1,146 @@
+import re
+import threading
+
+# 内置的 PII 检测器: (类型, 正则, 最大匹配长度)
+# 从左往右扫，同一个位置多个检测器都能匹配时排在前面的赢：
+# 长的放前面，免得身份证中间的一段数字被当成手机号，只脱敏了一半
+DEFAULT_DETECTORS = [
+    ("EMAIL", r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}", 254),    # 邮箱
+    ("ID", r"\d{17}[\dXx]|\d{15}", 18),                                     # 身份证
+    ("PHONE", r"1[3-9]\d{9}", 11),                                          # 手机号
+]
+
+
+class RedactionEngine:
+    """
+    单遍脱敏引擎：所有检测器编译成一个大 alternation，文本只扫一遍就完成替换
+    - redact() 返回 (脱敏后的文本, 命中的片段类型和位置)
+    - register() 可以随时加新的检测器 (重新编译一次)
+    - stream() 给分段到达的文本用 (PDF 一页一页读)，跨段的号码也能抓到
+    """
+
+    def __init__(self, detectors: list = None):
+        self._lock = threading.Lock()
+        self._detectors = []  # [(类型, 正则, 最大匹配长度)]
+        for name, pattern, max_length in (DEFAULT_DETECTORS if detectors is None else detectors):
+            self._detectors.append((name, pattern, max_length))
+        self._compile()
+
+    def _compile(self):
+        for name, pattern, _ in self._detectors:
+            re.compile(pattern)  # 单独编译一遍，写错的检测器能直接报出是哪一个
+        self._regex = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern, _ in self._detectors))
+        # 流式脱敏时要压住的尾巴长度：一个匹配最长能有多长
+        self.max_length = max((max_length for _, _, max_length in self._detectors), default=1)
+
+    def register(self, name: str, pattern: str, max_length: int):
+        """
+        新增一个检测器 (name 必须是合法的标识符，替换成 [NAME_REDACTED])
+        max_length: 这个检测器一次最多匹配多少个字符，流式脱敏靠它决定要等多少后续文本
+        """
+        with self._lock:
+            if any(existing == name for existing, _, _ in self._detectors):
+                raise ValueError(f"检测器已存在: {name}")
+            self._detectors.append((name, pattern, max_length))
+            try:
+                self._compile()
+            except re.error:
+                self._detectors.pop()
+                raise
+
+    @property
+    def detectors(self) -> list:
+        return [name for name, _, _ in self._detectors]
+
+    @staticmethod
+    def placeholder(name: str) -> str:
+        return f"[{name}_REDACTED]"
+
+    def redact(self, text: str) -> tuple:
+        """返回 (脱敏后的文本, [{"type", "start", "end"}])，位置是原文位置"""
+        spans = []
+        parts = []
+        last = 0
+        for match in self._regex.finditer(text):
+            parts.append(text[last:match.start()])
+            parts.append(self.placeholder(match.lastgroup))
+            spans.append({"type": match.lastgroup, "start": match.start(), "end": match.end()})
+            last = match.end()
+        if not spans:
+            return text, spans
+        parts.append(text[last:])
+        return "".join(parts), spans
+
+    def sub(self, text: str) -> str:
+        """只要脱敏后的文本"""
+        return self._regex.sub(lambda match: self.placeholder(match.lastgroup), text)
+
+    def stream(self) -> "StreamRedactor":
+        return StreamRedactor(self)
+
+
+class StreamRedactor:
+    """
+    流式脱敏：文本一段一段 feed 进来，能确定的部分立刻吐出去。
+    末尾 max_length 个字符先压着 (可能是一个跨段号码的前半截)，等下一段来了再判断。
+    同一段文本不管怎么切分，结果都和一次性 redact() 一样。
+    """
+
+    def __init__(self, engine: RedactionEngine):
+        self.engine = engine
+        self.spans = []     # 累计命中的片段 (位置是整个流里的原文位置)
+        self._pending = ""
+        self._offset = 0    # _pending 在整个流里的起始位置
+
+    def _emit(self, final: bool) -> str:
+        buffer = self._pending
+        # cutoff 之前的位置，后面能接上的字符都已经在 buffer 里了，匹配结果不会再变
+        cutoff = len(buffer) if final else len(buffer) - self.engine.max_length
+        if cutoff <= 0:
+            return ""
+        parts = []
+        last = 0
+        for match in self.engine._regex.finditer(buffer):
+            if match.start() >= cutoff:
+                break
+            parts.append(buffer[last:match.start()])
+            parts.append(self.engine.placeholder(match.lastgroup))
+            self.spans.append({
+                "type": match.lastgroup,
+                "start": self._offset + match.start(),
+                "end": self._offset + match.end()
+            })
+            last = match.end()
+        emit_until = max(cutoff, last)
+        parts.append(buffer[last:emit_until])
+        self._pending = buffer[emit_until:]
+        self._offset += emit_until
+        return "".join(parts)
+
+    def feed(self, text: str) -> str:
+        """喂一段原文，返回已经可以确定的脱敏文本 (可能是空串)"""
+        self._pending += text
+        return self._emit(final=False)
+
+    def flush(self) -> str:
+        """流结束：把压着的尾巴也处理掉"""
+        return self._emit(final=True)
+
+    def redacted_offsets(self, positions: list) -> list:
+        """
+        原文位置 -> 脱敏后文本里的位置 (positions 要从小到大)
+        落在某个被替换片段内部的位置，映射到占位符的开头
+        """
+        result = []
+        shift = 0
+        span_index = 0
+        for position in positions:
+            while span_index < len(self.spans) and self.spans[span_index]["end"] <= position:
+                span = self.spans[span_index]
+                shift += len(self.engine.placeholder(span["type"])) - (span["end"] - span["start"])
+                span_index += 1
+            if span_index < len(self.spans) and self.spans[span_index]["start"] < position:
+                result.append(self.spans[span_index]["start"] + shift)
+            else:
+                result.append(position + shift)
+        return result
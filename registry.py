@@ -0,0 +1,225 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl  # 只有 Linux/macOS 有；Windows 上单进程跑，不需要跨进程锁
+except ImportError:
+    fcntl = None
+import chromadb
+from openai import OpenAI, AsyncOpenAI
+from presidio_analyzer import AnalyzerEngine
+from presidio_anonymizer import AnonymizerEngine
+import config
+from intent_router import IntentRouter
+from ingest_manifest import IngestManifest
+from guard_profiles import build_analyzer
+from lexical_index import BM25Index, build_from_collection
+from rule_matcher import ReloadingMatcher
+from redaction import RedactionEngine
+from llm_transport import LLMTransport, create_client, create_async_client
+from pii_audit import PIIAuditor
+
+# ==========================================
+# 进程级组件注册表 (懒加载单例)
+# 重量级组件 (spaCy/Presidio、Chroma、LLM 客户端) 每种配置在一个进程里只创建一次，
+# SecuRAG / SecurityGuard / pdf_loader / dashboard 全部从这里拿，不再各自 new 一份。
+# ==========================================
+_components = {}   # key -> 组件实例
+_timings = {}      # key -> 创建耗时 (秒)
+_key_locks = {}    # key -> 锁 (不同组件可以并行加载，同一个组件只加载一次)
+_registry_lock = threading.Lock()
+
+# 只读、不持有连接/线程的组件，fork 之后子进程可以直接沿用 (写时复制共享内存页)
+# 其余的 (Chroma 句柄、HTTP 客户端、SQLite 连接...) 在子进程里必须重新创建
+FORK_SAFE_COMPONENTS = {"presidio_analyzer", "presidio_anonymizer", "screening_matcher", "redaction_engine"}
+
+
+def _after_fork_in_child():
+    global _registry_lock
+    for key in list(_components):
+        if key[0] not in FORK_SAFE_COMPONENTS:
+            del _components[key]
+            _timings.pop(key, None)
+    # fork 时别的线程可能正拿着锁，子进程里全部换成新锁
+    _key_locks.clear()
+    _registry_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _lock_for(key) -> threading.Lock:
+    with _registry_lock:
+        if key not in _key_locks:
+            _key_locks[key] = threading.Lock()
+        return _key_locks[key]
+
+
+def _get_or_create(key, factory):
+    component = _components.get(key)
+    if component is not None:
+        return component
+    with _lock_for(key):
+        if key not in _components:
+            start = time.perf_counter()
+            _components[key] = factory()
+            _timings[key] = time.perf_counter() - start
+            print(f"⏱️ [Registry] {key[0]} 加载完成，耗时 {_timings[key]:.2f}s")
+        return _components[key]
+
+
+def get_analyzer(profile: str = None) -> AnalyzerEngine:
+    """Presidio 分析器 (full 配置会加载 en_core_web_lg)，每套安检配置整个进程只加载一次"""
+    profile = profile or config.GUARD_PROFILE
+    return _get_or_create(("presidio_analyzer", profile), lambda: build_analyzer(profile))
+
+
+def get_anonymizer() -> AnonymizerEngine:
+    """Presidio 匿名化引擎 (入库时把识别出的实体替换掉)"""
+    return _get_or_create(("presidio_anonymizer",), AnonymizerEngine)
+
+
+@contextmanager
+def _interprocess_lock(path: str):
+    """
+    跨进程文件锁：多个 worker 同时启动时，Chroma 建库 / 建集合要排队做，
+    不然会撞上 "table already exists" 之类的初始化竞争
+    """
+    os.makedirs(path, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(path, ".init.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _create_chroma_client(path: str):
+    with _interprocess_lock(path):
+        return chromadb.PersistentClient(path=path)
+
+
+def get_chroma_client(path: str = "./my_local_db"):
+    return _get_or_create(("chroma_client", path), lambda: _create_chroma_client(path))
+
+
+def _create_collection(name: str, path: str):
+    client = get_chroma_client(path)
+    with _interprocess_lock(path):
+        return client.get_or_create_collection(name=name)
+
+
+def get_collection(name: str = "secure_knowledge_base", path: str = "./my_local_db"):
+    return _get_or_create(("chroma_collection", path, name), lambda: _create_collection(name, path))
+
+
+def llm_settings(mode: str) -> dict:
+    """按运行模式给出 LLM 连接参数 (local = Ollama，其余 = DeepSeek 云端)"""
+    if mode == "local":
+        ollama_host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+        return {
+            "base_url": f"{ollama_host}/v1",  # Ollama 的本地地址
+            "api_key": "ollama",  # 本地模式不需要 key，但必须填个占位符
+            "model_name": "deepseek-r1",
+            "trust_env": False  # 本地模式绕开系统代理 (自己传 httpx 客户端)
+        }
+    return {
+        "base_url": config.BASE_URL,
+        "api_key": os.getenv("DEEPSEEK_API_KEY"),
+        "model_name": config.MODEL_NAME,
+        "trust_env": True
+    }
+
+
+def get_llm_transport() -> LLMTransport:
+    """LLM 调用的统一出口 (超时 / 重试 / 对冲)，同步、异步客户端共用一份连接复用统计"""
+    return _get_or_create(("llm_transport",), LLMTransport)
+
+
+def get_llm_client(mode: str) -> OpenAI:
+    settings = llm_settings(mode)
+    return _get_or_create(
+        ("llm_client", settings["base_url"]),
+        lambda: create_client(
+            settings["base_url"], settings["api_key"],
+            trust_env=settings["trust_env"], metrics=get_llm_transport().metrics
+        )
+    )
+
+
+def get_async_llm_client(mode: str) -> AsyncOpenAI:
+    settings = llm_settings(mode)
+    return _get_or_create(
+        ("async_llm_client", settings["base_url"]),
+        lambda: create_async_client(
+            settings["base_url"], settings["api_key"],
+            trust_env=settings["trust_env"], metrics=get_llm_transport().metrics
+        )
+    )
+
+
+def get_intent_router(name: str = "secure_knowledge_base", path: str = "./my_local_db"):
+    """意图路由器：启动时要把原型样本 embedding 一遍，也只做一次"""
+    return _get_or_create(
+        ("intent_router", path, name),
+        lambda: IntentRouter(get_collection(name, path)._embedding_function)
+    )
+
+
+def get_manifest(path: str) -> IngestManifest:
+    """入库清单 (SQLite)，同一个文件在进程里只开一个连接"""
+    return _get_or_create(("ingest_manifest", path), lambda: IngestManifest(path))
+
+
+def get_lexical_index(name: str = "secure_knowledge_base", path: str = "./my_local_db") -> BM25Index:
+    """
+    BM25 倒排索引：第一次用到时从 Chroma 全量建好，之后本进程的入库/删除增量更新，
+    别的进程改了库 (知识库版本号变了) 由 SecuRAG 检索时触发后台重建
+    """
+    return _get_or_create(
+        ("lexical_index", path, name),
+        lambda: build_from_collection(
+            get_collection(name, path),
+            version=get_manifest(config.INGEST_MANIFEST_DB).collection_version(name)
+        )
+    )
+
+
+def get_screening_matcher(path: str = None) -> ReloadingMatcher:
+    """注入指令 / 危险关键词规则 (预编译的多模式匹配器，规则文件改了会自动热更新)"""
+    path = path or config.SCREENING_RULES_PATH
+    return _get_or_create(
+        ("screening_matcher", path),
+        lambda: ReloadingMatcher(path, check_interval=config.SCREENING_RELOAD_INTERVAL)
+    )
+
+
+def get_redaction_engine() -> RedactionEngine:
+    """PII 脱敏引擎 (所有检测器编译成一个正则)，在这里 register 的检测器全进程生效"""
+    return _get_or_create(("redaction_engine",), RedactionEngine)
+
+
+def get_pii_auditor(profile: str = None) -> PIIAuditor:
+    """
+    Presidio PII 审计 (后台线程 + 有界队列)：整个进程只开一个，
+    dashboard 每个会话一个 SecuRAG 也不会越开越多线程；关停时调 close() 把队列里的做完
+    """
+    profile = profile or config.GUARD_PROFILE
+    from security_guard import SecurityGuard  # security_guard 会 import registry，这里才 import 免得循环
+    return _get_or_create(
+        ("pii_auditor", profile, config.PII_AUDIT_LOG),
+        lambda: PIIAuditor(SecurityGuard(profile=profile))
+    )
+
+
+def startup_report() -> dict:
+    """各组件冷启动耗时 (秒)，看看启动时间都花在哪了"""
+    return {
+        " / ".join(str(part) for part in key): round(seconds, 3)
+        for key, seconds in sorted(_timings.items(), key=lambda item: -item[1])
+    }
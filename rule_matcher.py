@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import threading
+import unicodedata
+
+# 零宽字符 / 软连字符：肉眼看不见，常被用来把 "jail<零宽空格>break" 拆开绕过关键词
+_INVISIBLE = frozenset("\u00ad\u180e\u200b\u200c\u200d\u200e\u200f\u2060\u2061\u2062\u2063\u2064\ufeff")
+# 正则里的编号反向引用 \1 / 条件分组 (?(1)...)
+_NUMBERED_REFERENCE = re.compile(r"\\[1-9]|\(\?\(")
+
+
+def normalize_for_matching(text: str) -> tuple:
+    """
+    匹配前的归一化：NFKC (全角 -> 半角) + 大小写折叠 + 去掉零宽字符
+    返回 (归一化文本, offsets)，offsets[i] = 归一化文本第 i 个字符在原文里的位置，
+    这样命中位置可以映射回原文
+    """
+    if text.isascii():
+        return text.lower(), None  # 纯 ASCII 快速路径：位置一一对应
+    chars = []
+    offsets = []
+    for index, char in enumerate(text):
+        if char in _INVISIBLE:
+            continue
+        folded = unicodedata.normalize("NFKC", char).casefold()
+        chars.append(folded)
+        offsets.extend([index] * len(folded))
+    return "".join(chars), offsets
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 自动机：所有字面量关键词编译成一棵带失败指针的字典树，
+    文本只扫一遍就能找出全部 (包括重叠的) 命中，耗时和关键词数量无关
+    """
+
+    def __init__(self, words: list):
+        self._goto = [{}]     # 状态 -> {字符: 下一个状态}
+        self._fail = [0]
+        self._output = [[]]   # 状态 -> 在这里结束的关键词下标
+        for word_index, word in enumerate(words):
+            state = 0
+            for char in word:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(word_index)
+
+        # BFS 建失败指针，顺便把失败链上的输出合并进来 (扫描时不用再沿链找)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter(self, text: str):
+        """逐个产出 (关键词下标, 结束位置 + 1)"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word_index in output[state]:
+                yield word_index, position + 1
+
+
+class MultiPatternMatcher:
+    """
+    预编译的多模式匹配器：字面量走 Aho-Corasick (扫一遍，耗时和关键词数量无关)，
+    正则每条单独编译、单独匹配，返回所有命中的规则及其在原文中的位置。
+    正则不能只靠一个大 alternation 扫：finditer 在同一位置只报第一个分支，和它重叠的其他规则会被吞掉；
+    合并的 alternation 只用来做预筛 —— 大部分正常文本一条都不命中，扫一遍就能直接返回，
+    有命中时再逐条跑 (所以正则部分的耗时仍然随规则条数增长)
+    rules 格式: {类别: {"literals": [...], "patterns": [...]}}
+    """
+
+    def __init__(self, rules: dict):
+        self.rules = rules
+        self._literals = []  # 下标 -> (类别, 原始规则, 归一化后的长度)
+        words = []
+        self._patterns = []  # [(类别, 原始规则, 编译好的正则)]
+        for category, spec in rules.items():
+            for literal in spec.get("literals", []):
+                word, _ = normalize_for_matching(literal)
+                if word:
+                    words.append(word)
+                    self._literals.append((category, literal, len(word)))
+            for pattern in spec.get("patterns", []):
+                # 单独编译：写错的规则能直接报出是哪一条
+                self._patterns.append((category, pattern, re.compile(pattern)))
+        self._automaton = AhoCorasick(words)
+        # 预筛：任何一条规则能在文本里匹配上，合并后的 alternation 就一定能找到一个匹配
+        # 带编号反向引用 / 条件分组的规则合并后组号会错位，预筛可能漏报；
+        # 这种规则、以及合并后编译不了的 (比如带全局 flag)，就不预筛，每次逐条跑
+        self._prefilter = None
+        if self._patterns and not any(_NUMBERED_REFERENCE.search(pattern) for _, pattern, _ in self._patterns):
+            try:
+                self._prefilter = re.compile("|".join(f"(?:{pattern})" for _, pattern, _ in self._patterns))
+            except re.error:
+                pass
+
+    def scan(self, text: str) -> list:
+        """返回 [{"category", "rule", "start", "end"}]，start/end 是原文位置"""
+        normalized, offsets = normalize_for_matching(text)
+
+        def span(start, end):
+            if offsets is None:
+                return start, end
+            return offsets[start], offsets[end - 1] + 1
+
+        matches = []
+        for word_index, end in self._automaton.iter(normalized):
+            category, rule, length = self._literals[word_index]
+            start, stop = span(end - length, end)
+            matches.append({"category": category, "rule": rule, "start": start, "end": stop})
+        if self._patterns and (self._prefilter is None or self._prefilter.search(normalized)):
+            for category, rule, regex in self._patterns:
+                for found in regex.finditer(normalized):
+                    if found.end() == found.start():
+                        continue
+                    start, stop = span(found.start(), found.end())
+                    matches.append({"category": category, "rule": rule, "start": start, "end": stop})
+        matches.sort(key=lambda match: (match["start"], match["end"]))
+        return matches
+
+    def size(self) -> int:
+        return len(self._literals) + len(self._patterns)
+
+
+class ReloadingMatcher:
+    """
+    从 JSON 规则文件加载的匹配器，文件一改自动热更新 (不用重启 API)
+    - 最多每 check_interval 秒看一次文件修改时间
+    - 新规则编译失败就继续用旧规则，不会把护栏弄没
+    """
+
+    def __init__(self, path: str, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.matcher = self._load()
+
+    def _load(self) -> MultiPatternMatcher:
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            matcher = MultiPatternMatcher(json.load(f))
+        self._mtime = mtime
+        print(f"📜 [Screening] 已加载 {matcher.size()} 条规则: {self.path}")
+        return matcher
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime == self._mtime:
+                    return
+                self._mtime = mtime  # 坏文件也记下，改好之前不反复报错
+                self.matcher = self._load()
+                self.reloads += 1
+            except Exception as e:
+                print(f"⚠️ [Screening] 规则文件重新加载失败，继续使用旧规则: {e}")
+
+    def scan(self, text: str) -> list:
+        self._maybe_reload()
+        return self.matcher.scan(text)
+
+    def stats(self) -> dict:
+        return {"path": self.path, "rules": self.matcher.size(), "reloads": self.reloads}
@@ -1,34 +1,50 @@
-import re
-from presidio_analyzer import AnalyzerEngine
+import registry
+import config
+from presidio_analyzer import BatchAnalyzerEngine
+from caching import LRUTTLCache
+from guard_profiles import GUARD_PROFILES, has_entity_candidates
 
 class SecurityGuard:
-    def __init__(self):
+    def __init__(self, analyzer=None, profile: str = None):
         # 🚫 黑名单：任何包含这些意图的词都会被拦截
         # 这种基于规则的拦截叫 "Deterministic Guardrails" (确定性护栏)
         print("🛡️ 加载安全组件...")
-        self.analyzer = AnalyzerEngine()
-        self.injection_patterns = [
-            r"ignore all previous instructions",
-            r"ignore the above instructions",
-            r"you are now dan",  # 著名的 DAN 越狱模式
-            r"you are now a pirate",
-            r"system prompt",   # 防止套取系统设定
-            r"simulated mode",
-            r"dev mode",
-            r"jailbreak"
-        ]
+        # 不传就用进程级共享的 Presidio (同一套安检配置整个进程只加载一次)
+        self.profile = profile or config.GUARD_PROFILE
+        self.analyzer = analyzer or registry.get_analyzer(self.profile)
+        # light 配置：没有"像实体"的字符 (大写/数字/@) 就不跑 NER
+        self.prefilter = GUARD_PROFILES[self.profile]["prefilter"]
+        self.prefilter_skips = 0
+        # 规则 (注入指令 + 危险关键词) 放在 screening_rules.json 里，编译成一个多模式匹配器，
+        # 一次扫描就能找出所有命中；改规则文件不用重启服务
+        self.matcher = registry.get_screening_matcher()
+        # 同一句话 check_injection 和防火墙关键词检查都要看，扫一次、两边共用结果
+        self._screen_cache = LRUTTLCache(maxsize=1024, ttl=60)
+        # PII 脱敏引擎 (进程级共享)
+        self.redactor = registry.get_redaction_engine()
+        # 批量分析：一批文本走一次 spaCy nlp.pipe，而不是一条一条跑完整流水线
+        self.batch_analyzer = BatchAnalyzerEngine(analyzer_engine=self.analyzer)
+
+    def screen(self, text: str) -> list:
+        """
+        一次扫描，返回所有命中的规则: [{"category", "rule", "start", "end"}]
+        匹配前会做全角 -> 半角、大小写折叠、去零宽字符，start/end 是原文位置
+        """
+        # 规则热更新后版本号 +1，旧结果自然不再命中
+        matches = self._screen_cache.get((self.matcher.reloads, text))
+        if matches is None:
+            matches = self.matcher.scan(text)
+            self._screen_cache.set((self.matcher.reloads, text), matches)
+        return matches
 
     def check_injection(self, text: str) -> bool:
         """
         检查是否包含恶意注入指令
         返回: True (有攻击行为), False (安全)
         """
-        text_lower = text.lower() # 转小写，防止大小写绕过
-        
-        for pattern in self.injection_patterns:
-            # re.search 比 re.match 更强，只要句子里藏着这个词就能抓出来
-            if re.search(pattern, text_lower):
-                print(f"🚨 Security Alert: Detected injection attempt -> '{pattern}'")
+        for match in self.screen(text):
+            if match["category"] == "injection":
+                print(f"🚨 Security Alert: Detected injection attempt -> '{match['rule']}'")
                 return True
         
         return False
@@ -36,16 +52,20 @@ class SecurityGuard:
     def _sanitize_input(self, text: str) -> str:
         """
         [私有方法] 第一道防线：正则 + 简单脱敏
+        手机号 / 邮箱 / 身份证 (以及后来 register 的检测器) 合成一个正则，一遍扫完
         """
-        # 1. 正则清洗 (Day 15 的逻辑)
-        # 手机号
-        text = re.sub(r"1[3-9]\d{9}", "[PHONE_REDACTED]", text)
-        # 邮箱
-        text = re.sub(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}", "[EMAIL_REDACTED]", text)
-        # 身份证
-        text = re.sub(r"\d{17}[\dXx]|\d{15}", "[ID_REDACTED]", text)
-        
-        return text
+        return self.redactor.sub(text)
+
+    def redact(self, text: str) -> tuple:
+        """脱敏并返回命中的片段: (脱敏后的文本, [{"type", "start", "end"}])"""
+        return self.redactor.redact(text)
+
+    def find_pii(self, text: str) -> list:
+        """Presidio 实体识别 (light 配置先过预筛，明显没有实体的句子直接返回空)"""
+        if self.prefilter and not has_entity_candidates(text):
+            self.prefilter_skips += 1
+            return []
+        return self.analyzer.analyze(text=text, language='en')
 
     def _check_safety(self, text: str) -> bool:
         """
@@ -53,7 +73,7 @@ class SecurityGuard:
         返回 True 表示安全，False 表示有风险
         """
         # Day 16 的逻辑
-        results = self.analyzer.analyze(text=text, language='en')
+        results = self.find_pii(text)
         
         # 如果发现有人名 (PERSON) 或 地名 (LOCATION)，不仅要拦截，最好报警
         for res in results:
@@ -62,5 +82,40 @@ class SecurityGuard:
                 # 这里可以根据策略决定是否拦截，演示时我们只做警告
                 # return False 
         return True
-    
-    
\ No newline at end of file
+
+    def analyze_batch(self, texts: list, batch_size: int = None, n_process: int = None,
+                      score_threshold: float = None) -> list:
+        """
+        Presidio 批量分析：内部用 spaCy 的 nlp.pipe 成批跑 NER
+        返回和 texts 一一对应 (顺序不变) 的 [[RecognizerResult, ...], ...]
+        batch_size / n_process 不传就用 config 里的默认值 (n_process > 1 会开多进程，每个进程各加载一份模型)
+        """
+        results = [[] for _ in texts]
+        # light 配置：只把过了预筛的文本送进 spaCy，结果再按原顺序放回去
+        indices = [i for i, text in enumerate(texts) if not self.prefilter or has_entity_candidates(text)]
+        self.prefilter_skips += len(texts) - len(indices)
+        if not indices:
+            return results
+        found = self.batch_analyzer.analyze_iterator(
+            [texts[i] for i in indices],
+            language="en",
+            batch_size=batch_size or config.PRESIDIO_BATCH_SIZE,
+            n_process=n_process or config.PRESIDIO_N_PROCESS,
+            score_threshold=config.PRESIDIO_SCORE_THRESHOLD if score_threshold is None else score_threshold
+        )
+        for i, text_results in zip(indices, found):
+            results[i] = text_results
+        return results
+
+    def anonymize_batch(self, texts: list, batch_size: int = None, n_process: int = None) -> tuple:
+        """
+        批量分析 + 匿名化：识别出的实体替换成 <实体类型>
+        返回 (匿名化后的文本列表, 每条文本的分析结果)
+        """
+        results = self.analyze_batch(texts, batch_size=batch_size, n_process=n_process)
+        anonymizer = registry.get_anonymizer()
+        anonymized = [
+            anonymizer.anonymize(text=text, analyzer_results=found).text if found else text
+            for text, found in zip(texts, results)
+        ]
+        return anonymized, results
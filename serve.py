@@ -0,0 +1,154 @@
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import config
+from metrics import process_memory
+
+# ==========================================
+# 预加载 + fork 的多 worker 启动器
+# 主进程先把只读的重量级组件 (spaCy/Presidio、规则匹配器、脱敏引擎) 加载好，再 fork 出 worker；
+# worker 通过写时复制共享这些内存页，不用每个进程都从头加载一遍 en_core_web_lg。
+# Chroma 句柄、LLM 的 HTTP 客户端、SQLite 连接这些不能跨进程用的东西，
+# fork 后由 registry 自动丢掉，worker 里第一次用到时重新创建。
+# 用法: python serve.py   (worker 数 / 端口见 config.SERVER_*)
+# ==========================================
+_workers = {}  # pid -> worker 编号
+_stopping = False
+_STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+
+def preload():
+    """主进程里加载可以共享的只读组件"""
+    # registry 在这里才 import：PDF 抽取的进程池用 spawn，子进程会重新 import 主模块 (本文件)，
+    # 顶层只留轻量的 import，子进程才起得快
+    import registry
+    start = time.perf_counter()
+    registry.get_analyzer(config.GUARD_PROFILE)
+    registry.get_screening_matcher()
+    registry.get_redaction_engine()
+    if config.INGEST_PII_MODE == "anonymize":
+        registry.get_anonymizer()
+    # 把目前所有对象移出 GC 的扫描范围：GC 不再去碰这些对象的头部，共享页就不会被写脏、复制
+    gc.freeze()
+    print(f"📦 [Master] 预加载完成，耗时 {time.perf_counter() - start:.2f}s，内存: {process_memory()}")
+
+
+def bind_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((config.SERVER_HOST, config.SERVER_PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index: int, sock: socket.socket, first_start: bool, replaces: int = None):
+    """
+    [子进程] 启动一个 uvicorn worker，和其他 worker 共用同一个监听 socket
+    replaces: 顶替的是哪个挂掉的 worker (pid)，它名下没跑完的入库任务由这个 worker 接手
+    """
+    if first_start:
+        # 上次服务没跑完的入库任务只让 0 号 worker 恢复
+        config.INGEST_RESUME_ON_START = index == 0
+    else:
+        config.INGEST_RESUME_ON_START = replaces is not None
+        config.INGEST_RESUME_OWNER = replaces
+    import uvicorn
+    import api_server  # 这里才创建 SecuRAG：Presidio 直接用主进程加载好的那份
+    server = uvicorn.Server(uvicorn.Config(api_server.app, log_level="info"))
+    server.run(sockets=[sock])
+
+
+def spawn(index: int, sock: socket.socket, first_start: bool = False, replaces: int = None) -> int:
+    sys.stdout.flush()  # 不然缓冲区里还没输出的内容会被子进程再打印一遍
+    # fork 前后先屏蔽 SIGTERM / SIGINT：子进程换回默认处理之前、主进程登记好新 worker 之前收到的信号
+    # 都先挂着，解除屏蔽后再处理 (不会在子进程里跑主进程的 stop，也不会漏杀刚 fork 出来的 worker)
+    signal.pthread_sigmask(signal.SIG_BLOCK, _STOP_SIGNALS)
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _STOP_SIGNALS)
+            run_worker(index, sock, first_start, replaces)
+        except Exception as e:
+            print(f"❌ [Worker {index}] 异常退出: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    _workers[pid] = index
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _STOP_SIGNALS)
+    print(f"👷 [Master] worker {index} 已启动 (pid {pid})")
+    return pid
+
+
+def report_memory():
+    """各 worker 的内存：rss 含共享页，pss 是均摊后的真实占用，按 pss 之和估算容器大小"""
+    rows = [("master", os.getpid(), process_memory())]
+    rows += [(f"worker {index}", pid, process_memory(pid)) for pid, index in sorted(_workers.items(), key=lambda item: item[1])]
+    print("📊 [Master] 内存 (MB):")
+    for name, pid, memory in rows:
+        print(f"   {name:<9} pid={pid:<7} rss={memory.get('rss_mb', '?'):<8} pss={memory.get('pss_mb', '?'):<8} "
+              f"shared={memory.get('shared_mb', '?'):<8} private={memory.get('private_mb', '?')}")
+    total_pss = sum(memory.get("pss_mb", 0.0) for _, _, memory in rows)
+    print(f"   合计 pss ≈ {total_pss:.1f} MB")
+
+
+def stop(signum, frame):
+    global _stopping
+    _stopping = True
+    for pid in list(_workers):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    if not hasattr(os, "fork"):
+        sys.exit("❌ 预加载 + fork 模式只支持 Linux/macOS，Windows 请直接用 uvicorn api_server:app")
+    if config.SERVER_WORKERS > 1 and config.SESSION_BACKEND != "sqlite":
+        # 内存会话存储每个 worker 各一份，同一个会话的请求落到不同 worker 上就丢历史了
+        print("⚠️ [Master] 多 worker 模式下会话改用 SQLite 存储 (各 worker 共享)")
+        config.SESSION_BACKEND = "sqlite"
+
+    print(f"🚀 [Master] 预加载 + fork 模式: {config.SERVER_WORKERS} 个 worker, "
+          f"监听 {config.SERVER_HOST}:{config.SERVER_PORT}")
+    preload()
+    sock = bind_socket()
+    # 先装好信号处理再 fork：启动过程中收到 SIGTERM 也能把已经起来的 worker 一起停掉
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(config.SERVER_WORKERS):
+        if _stopping:
+            break
+        spawn(index, sock, first_start=True)
+
+    next_report = time.monotonic() + min(10.0, config.SERVER_MEMORY_REPORT_INTERVAL)
+    while _workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            index = _workers.pop(pid)
+            if not _stopping:
+                print(f"⚠️ [Master] worker {index} (pid {pid}) 退出了 (状态 {status})，1 秒后重新拉起")
+                time.sleep(1)
+                if not _stopping:  # 等的这 1 秒里可能收到了 SIGTERM
+                    # 新 worker 接手旧 worker 名下排队中 / 跑到一半的入库任务
+                    spawn(index, sock, replaces=pid)
+            continue
+        if not _stopping and time.monotonic() >= next_report:
+            report_memory()
+            next_report = time.monotonic() + config.SERVER_MEMORY_REPORT_INTERVAL
+        time.sleep(0.5)
+    print("👋 [Master] 所有 worker 已退出")
+
+
+if __name__ == "__main__":
+    main()
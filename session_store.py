@@ -0,0 +1,232 @@
+import os
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from itertools import islice
+from collections import OrderedDict, deque
+import config
+
+
+class SessionStore(ABC):
+    """
+    会话存储接口：引擎只通过这几个方法读写历史
+    - recent(): 只取 Prompt 需要的最后 N 条消息 (返回副本，不暴露内部结构)
+    - append_turn(): 记一轮对话 (user + assistant)
+    """
+
+    @abstractmethod
+    def recent(self, session_id: str, n: int) -> list:
+        ...
+
+    @abstractmethod
+    def append_turn(self, session_id: str, user_query: str, answer: str):
+        ...
+
+    @abstractmethod
+    def clear(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    """
+    内存后端：LRU + 空闲超时
+    - 会话数超过 max_sessions 时淘汰最久没活动的会话
+    - 超过 idle_ttl 秒没活动的会话直接过期
+    - 每个会话最多保留 max_turns 轮，旧的自动挤掉
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 3600.0, max_turns: int = 50):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()  # session_id -> (最后活动时间, deque[消息])
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expire(self, now: float):
+        # OrderedDict 按活动时间排序，只需要从头部开始检查
+        while self._sessions:
+            session_id, (last_active, _) = next(iter(self._sessions.items()))
+            if now - last_active < self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.expirations += 1
+
+    def recent(self, session_id: str, n: int) -> list:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._sessions.get(session_id)
+            if item is None:
+                return []
+            messages = item[1]
+            self._sessions[session_id] = (now, messages)
+            self._sessions.move_to_end(session_id)
+            # 从尾部倒着取 n 条再翻回来，不把整个会话 (最多 max_turns 轮) 复制一遍
+            recent = list(islice(reversed(messages), n)) if n > 0 else []
+            recent.reverse()
+            return recent
+
+    def append_turn(self, session_id: str, user_query: str, answer: str):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._sessions.get(session_id)
+            messages = item[1] if item else deque(maxlen=self.max_turns * 2)
+            messages.append({"role": "user", "content": user_query})
+            messages.append({"role": "assistant", "content": answer})
+            self._sessions[session_id] = (now, messages)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            message_count = sum(len(messages) for _, messages in self._sessions.values())
+            # 粗略估算：只算消息正文的字节数
+            content_bytes = sum(
+                len(msg["content"].encode("utf-8"))
+                for _, messages in self._sessions.values() for msg in messages
+            )
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": message_count,
+                "content_bytes": content_bytes,
+                "max_sessions": self.max_sessions,
+                "max_turns": self.max_turns,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite (WAL) 后端：重启不丢，多个 uvicorn worker 可以共享同一个库文件
+    """
+
+    def __init__(self, path: str, idle_ttl: float = 3600.0, max_turns: int = 50):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS session_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_messages ON session_messages(session_id, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_active REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def recent(self, session_id: str, n: int) -> list:
+        if n <= 0:
+            return []
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_active FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or time.time() - row[0] >= self.idle_ttl:
+                return []
+            rows = self._conn.execute(
+                "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, n)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def append_turn(self, session_id: str, user_query: str, answer: str):
+        now = time.time()
+        with self._lock, self._conn:
+            # 会话已经过期：先把旧消息清掉，当成一个新会话
+            self._conn.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND EXISTS ("
+                "SELECT 1 FROM sessions WHERE session_id = ? AND last_active < ?)",
+                (session_id, session_id, now - self.idle_ttl)
+            )
+            self._conn.executemany(
+                "INSERT INTO session_messages (session_id, role, content) VALUES (?, ?, ?)",
+                [(session_id, "user", user_query), (session_id, "assistant", answer)]
+            )
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, last_active) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_active = excluded.last_active",
+                (session_id, now)
+            )
+            # 只保留最近 max_turns 轮
+            self._conn.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND id NOT IN ("
+                "SELECT id FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_turns * 2)
+            )
+            self._writes += 1
+            # 每写 100 次顺手清理一次过期会话，不单独开线程
+            if self._writes % 100 == 0:
+                self._purge_expired(now)
+
+    def _purge_expired(self, now: float):
+        # 调用方需持有锁，并处在事务里
+        cutoff = now - self.idle_ttl
+        self._conn.execute(
+            "DELETE FROM session_messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_active < ?)",
+            (cutoff,)
+        )
+        self._conn.execute("DELETE FROM sessions WHERE last_active < ?", (cutoff,))
+
+    def clear(self, session_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages, content_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM session_messages"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": sessions,
+            "messages": messages,
+            "content_bytes": content_bytes,
+            "db_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "max_turns": self.max_turns
+        }
+
+
+def create_session_store() -> SessionStore:
+    """按 config.SESSION_BACKEND 创建会话存储"""
+    if config.SESSION_BACKEND == "sqlite":
+        print(f"💾 [Session] 使用 SQLite 会话存储: {config.SESSION_DB_PATH}")
+        return SQLiteSessionStore(
+            config.SESSION_DB_PATH,
+            idle_ttl=config.SESSION_IDLE_TTL,
+            max_turns=config.SESSION_MAX_TURNS
+        )
+    return MemorySessionStore(
+        max_sessions=config.SESSION_MAX_SESSIONS,
+        idle_ttl=config.SESSION_IDLE_TTL,
+        max_turns=config.SESSION_MAX_TURNS
+    )